@@ -0,0 +1,249 @@
+'''
+Reader for MODFLOW-2005 Discretization (DIS) files
+
+Reads the header (NLAY NROW NCOL NPER ITMUNI LENUNI), LAYCBD, DELR, DELC, the model top
+and layer bottoms, and the stress period information. Arrays can be given with any of the
+array control records: CONSTANT, INTERNAL, OPEN/CLOSE (text or binary), or the fixed-format
+LOCAT CNSTNT FMTIN IPRN record with LOCAT = 0 (EXTERNAL arrays and other units require the name file, and aren't supported).
+
+Text arrays are parsed in bulk with numpy (free or fixed-width Fortran formats);
+binary OPEN/CLOSE arrays are memory-mapped, and external free-format text arrays are parsed
+in one numpy call when the file holds just the array values (nothing is written to the model folder).
+
+usage:
+import DIS_utils
+dis = DIS_utils.read_dis('BadRiver.dis')
+layer_elevs = dis['elevations'] # (nlay+1, nrow, ncol) model top and layer bottoms
+'''
+import os
+import re
+import numpy as np
+
+
+def _strip_comments(lines):
+    return [line for line in lines if not line.lstrip().startswith('#')]
+
+
+def _expand_repeats(tokens):
+    '''
+    values from free-format tokens, with repeat counts (n*value, as in Fortran list-directed input) expanded
+    '''
+    values = []
+    for token in tokens:
+        if '*' in token:
+            count, value = token.split('*', 1)
+            try:
+                values += [float(value)] * int(count)
+            except ValueError:
+                raise ValueError('invalid repeat count or value: {}'.format(token))
+            continue
+        try:
+            values.append(float(token))
+        except ValueError:
+            raise ValueError('invalid value in free-format array: {}'.format(token))
+    return values
+
+
+def _parse_free(lines, n, count, rowlength=None):
+    '''
+    read count values in free format starting at line n; if rowlength is given, each row of
+    rowlength values starts on a new line (as with a Fortran list-directed read for each row).
+    Repeat counts (e.g. 100*1.0) are expanded.
+
+    returns array of values, and index of the next line
+    '''
+    if rowlength is None:
+        rowlength = count
+    # common case: one row per line
+    nrows = count // rowlength
+    if len(lines[n].replace(',', ' ').split()) == rowlength:
+        text = ' '.join(lines[n:n + nrows]).replace(',', ' ')
+        if '*' not in text:
+            try:
+                values = np.fromstring(text, sep=' ')
+            except ValueError: # newer numpy versions raise instead of stopping at text that isn't a number
+                values = []
+            if len(values) == count:
+                return values, n + nrows
+    values = []
+    for r in range(nrows):
+        row = []
+        while len(row) < rowlength:
+            if n >= len(lines):
+                raise ValueError('end of file reading a free-format array of {} values'.format(count))
+            row += _expand_repeats(lines[n].replace(',', ' ').split())
+            n += 1
+        values += row[:rowlength]
+    return np.array(values), n
+
+
+def _parse_fixed(lines, n, count, rowlength, perline, width):
+    '''
+    read count values from fixed-width fields (perline fields of width characters per line),
+    with each row of rowlength values starting on a new line
+    '''
+    nrows = count // rowlength
+    linesperrow = -(-rowlength // perline)
+    values = []
+    for r in range(nrows):
+        row = ''.join([lines[n + l].rstrip('\r\n').ljust(perline * width) for l in range(linesperrow)])
+        values += [row[v * width:(v + 1) * width] for v in range(rowlength)]
+        n += linesperrow
+    return np.array(values, dtype=float), n
+
+
+def _real(text):
+    # Fortran real, including double precision exponents (e.g. 1.0D0)
+    return float(text.strip().replace('d', 'e').replace('D', 'E'))
+
+
+def _fortran_format(fmtin):
+    '''
+    (values per line, field width) for a Fortran format such as (10E12.4); None for free format
+    '''
+    fmtin = fmtin.strip().strip("'\"").upper()
+    if fmtin in ('(FREE)', '*', 'FREE', ''):
+        return None
+    # an optional scale factor (e.g. 1P in (1P10E12.4)) comes before the repeat count
+    m = re.match(r'\(\s*(?:[+-]?\d*P\s*,?\s*)?(\d*)\s*[A-Z]+(\d+)', fmtin)
+    if m is None:
+        return None
+    return int(m.group(1) or 1), int(m.group(2))
+
+
+def read_binary_array(filename, count):
+    '''
+    memory-map a MODFLOW binary array file (header record followed by count values), in single or double
+    precision, with or without Fortran sequential record markers
+    '''
+    size = os.path.getsize(filename)
+    for real, header in [('<f4', 44), ('<f8', 52)]:
+        itemsize = np.dtype(real).itemsize
+        if size == header + count * itemsize: # stream access
+            return np.memmap(filename, dtype=real, mode='r', offset=header, shape=(count,))
+        if size == header + 8 + count * itemsize + 8: # sequential access (4-byte record markers)
+            return np.memmap(filename, dtype=real, mode='r', offset=header + 12, shape=(count,))
+    raise ValueError('size of {} does not match a binary array of {} values'.format(filename, count))
+
+
+def read_array(lines, n, shape, path='.'):
+    '''
+    read a 1D or 2D array (U1DREL/U2DREL) starting with its control record at line n
+
+    shape: (ncol,) for 1D arrays, or (nrow, ncol)
+    path: folder for OPEN/CLOSE files (normally the folder of the model name file)
+
+    returns array, and index of the next line
+    '''
+    count = int(np.prod(shape))
+    rowlength = shape[-1] if len(shape) > 1 else count
+    control = lines[n]
+    tokens = control.split()
+    key = tokens[0].upper()
+    n += 1
+
+    if key == 'CONSTANT':
+        return np.ones(shape) * _real(tokens[1]), n
+    if key == 'INTERNAL':
+        cnstnt = _real(tokens[1]) if len(tokens) > 1 else 1.
+        fmtin = tokens[2] if len(tokens) > 2 else '(FREE)'
+        source = None
+    elif key == 'OPEN/CLOSE':
+        source = os.path.join(path, tokens[1].strip("'\""))
+        cnstnt = _real(tokens[2]) if len(tokens) > 2 else 1.
+        fmtin = tokens[3] if len(tokens) > 3 else '(FREE)'
+    elif key == 'EXTERNAL':
+        raise ValueError('EXTERNAL arrays (which require the name file) are not supported: {}'.format(control.strip()))
+    else:
+        # fixed format LOCAT CNSTNT FMTIN IPRN
+        locat = int(control[:10])
+        cnstnt = _real(control[10:20])
+        if locat != 0:
+            raise ValueError('arrays read from other units are not supported: {}'.format(control.strip()))
+        return np.ones(shape) * cnstnt, n
+
+    fortran = _fortran_format(fmtin)
+    if 'BINARY' in fmtin.upper():
+        if source is None:
+            raise ValueError('INTERNAL binary arrays are not supported')
+        values = read_binary_array(source, count)
+    else:
+        values = []
+        if source is not None:
+            with open(source) as infile:
+                text = infile.read()
+            if fortran is None and '*' not in text:
+                try:
+                    values = np.fromstring(text.replace(',', ' '), sep=' ')
+                except ValueError: # newer numpy versions raise instead of stopping at text that isn't a number
+                    values = []
+            arrlines, start = text.splitlines(True), 0
+        else:
+            arrlines, start = lines, n
+        if len(values) != count:
+            if fortran is None:
+                values, end = _parse_free(arrlines, start, count, rowlength)
+            else:
+                values, end = _parse_fixed(arrlines, start, count, rowlength, *fortran)
+            if source is None:
+                n = end
+    if len(values) < count:
+        raise ValueError('{} values expected for array {}'.format(count, control.strip()))
+    values = values[:count].reshape(shape)
+    if cnstnt != 0 and cnstnt != 1:
+        values = values * cnstnt
+    return values, n
+
+
+def read_dis(DISfile, path=None):
+    '''
+    read a MODFLOW-2005 DIS file
+
+    path: folder for OPEN/CLOSE files (default is the folder of DISfile)
+
+    returns dict with nlay, nrow, ncol, nper, itmuni, lenuni, laycbd, delr, delc, top,
+    botm (nlay, nrow, ncol), elevations (nlay+1, nrow, ncol; top followed by the layer bottoms),
+    cbd_bots (bottoms of any quasi-3D confining beds, in the order of the layers that have them),
+    and perlen, nstp, tsmult and steady (stress period information)
+    '''
+    if path is None:
+        path = os.path.dirname(os.path.abspath(DISfile))
+    with open(DISfile) as infile:
+        lines = _strip_comments(infile.readlines())
+
+    nlay, nrow, ncol, nper, itmuni, lenuni = [int(v) for v in lines[0].split()[:6]]
+    n = 1
+    laycbd = []
+    while len(laycbd) < nlay:
+        laycbd += [int(v) for v in lines[n].split()]
+        n += 1
+    laycbd = np.array(laycbd[:nlay])
+
+    delr, n = read_array(lines, n, (ncol,), path)
+    delc, n = read_array(lines, n, (nrow,), path)
+    elevations = np.empty((nlay + 1, nrow, ncol))
+    elevations[0], n = read_array(lines, n, (nrow, ncol), path)
+    cbd_bots = []
+    for k in range(nlay):
+        elevations[k + 1], n = read_array(lines, n, (nrow, ncol), path)
+        if laycbd[k] != 0 and k < nlay - 1:
+            cbd, n = read_array(lines, n, (nrow, ncol), path)
+            cbd_bots.append(cbd)
+
+    perlen, nstp, tsmult, steady = [], [], [], []
+    for p in range(nper):
+        if n >= len(lines):
+            break
+        tokens = lines[n].split()
+        perlen.append(float(tokens[0]))
+        nstp.append(int(tokens[1]))
+        tsmult.append(float(tokens[2]))
+        steady.append(tokens[3].upper().startswith('SS'))
+        n += 1
+
+    return {'nlay': nlay, 'nrow': nrow, 'ncol': ncol, 'nper': nper, 'itmuni': itmuni, 'lenuni': lenuni,
+            'laycbd': laycbd, 'delr': delr, 'delc': delc,
+            'top': elevations[0], 'botm': elevations[1:], 'elevations': elevations,
+            'cbd_bots': np.array(cbd_bots).reshape(-1, nrow, ncol),
+            'perlen': np.array(perlen), 'nstp': np.array(nstp, dtype=int), 'tsmult': np.array(tsmult),
+            'steady': np.array(steady, dtype=bool)}
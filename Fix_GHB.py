@@ -3,110 +3,78 @@
 # Based on error_chkr.py, but includes fix for land surface elevations that are above GHB stages
 
 import numpy as np
-from collections import defaultdict
+import grid_utils
+import listpackage_utils
+import MFarray_utils
 
 # hard coded model dimensions
 rows=800
 columns=800
-layers=5
+# layers will be based on length of input GWV matrix and number of cells
 
 # Input files
 botsfile='BR_L1L5bot.DAT' # GWV mat with bottom elevations for all layers
 l1topfile='L1top.DAT' # GWV mat with top elevations for layer 1
 err_file='modflow.err'
 GHB_file='BadRiver.ghb'
-GHB_stage=601.7 # for simple case of all GHBs having same stage
+GHB_stage=None # single stage for all GHBs (e.g. 601.7), or None to use the stage of each GHB cell in GHB_file
+
+# Settings
+min_thickness=1. # minimum layer thickness after fixes (same units as elevations)
 
 # Output file
 GHBout=GHB_file[:-4]+'_fixed.csv'
 
-# get offending cells
-errs=open(err_file,'r').readlines()
-
-err_cells=defaultdict(list)
-for line in errs:
+# get offending cells (row, column, layer); only the last warning for each cell is kept
+err_cells=[]
+for line in open(err_file,'r'):
     if "*** Warning ***" in line:
-        r,c,l=map(int,line[line.find("(")+1:line.find(")")].split(','))
-        cellnum=(r-1)*columns+c
-        err_cells[cellnum]=[r,c,l]
+        err_cells.append(map(int,line[line.find("(")+1:line.find(")")].split(',')))
+err_cells=np.array(err_cells,dtype=int).reshape(-1,3)
+cellnums=(err_cells[:,0]-1)*columns+err_cells[:,1]
+last=len(cellnums)-1-np.unique(cellnums[::-1],return_index=True)[1]
+err_r,err_c,err_l=err_cells[last].T
+
+# load in GWV matricies (binary copies are cached in .gwv_cache after the first run)
+grid=grid_utils.ModelGrid.from_GWV(botsfile,l1topfile,rows,columns)
+layers=grid.nlay
 
-# load in GWV matricies
-bots=np.fromfile(botsfile,sep=" ")
-bots_rs=bots.reshape(layers,rows,columns) # apparently np convention is l,r,c
-l1top=np.fromfile(l1topfile,sep=" ")
-l1tops=l1top.reshape(rows,columns)
-cellnums=np.reshape(np.arange(1,(rows*columns+1)),(rows,columns))
+# GHB stage for each error cell; where a cell has GHBs in several layers, the lowest stage is used
+if GHB_stage is None:
+    ghb_cells,ghb_values=listpackage_utils.read_first_period(GHB_file)
+    stages=np.empty((grid.nrow,grid.ncol))
+    stages.fill(np.inf)
+    np.minimum.at(stages,(ghb_cells[:,1]-1,ghb_cells[:,2]-1),ghb_values[:,0])
+    err_stage=stages[err_r-1,err_c-1]
+    if np.isinf(err_stage).any():
+        print "no GHB in %s for %s error cells; land surface left unchanged" %(GHB_file,np.isinf(err_stage).sum())
+else:
+    err_stage=np.empty(len(err_r))
+    err_stage.fill(GHB_stage)
 
-# add GHB stages, L1top, and cell bottoms for each layer
-for cell in err_cells.iterkeys():
-    err_cells[cell].append(GHB_stage)
-    bots=list(bots_rs[:,err_cells[cell][0]-1,err_cells[cell][1]-1])
-    l1top=l1tops[err_cells[cell][0]-1,err_cells[cell][1]-1]
-    topandbots=[l1top]
-    for l in range(layers):
-        topandbots.append(bots[l])
-    err_cells[cell].append(topandbots)
-    
-    # fix cell bottoms and tops for cells with lands surface above GHB stages
-    
-    # set land surface to GHB stage
-    l1top_old=l1top
-    l1top=GHB_stage
-    
-    # lower bottoms until all are lower than land surface
-    for b in range(layers):
-        # Reset L1 bot to 1 ft below L1top if it is <1 ft below L1top
-        if b==0:
-            if bots[b]>(l1top-1):
-                bots[b]=l1top-1
-        else:
-            if bots[b]>(bots[b-1]-1): # if next layer is less than 1 foot below previous, reset to 1 ft below
-                bots[b]=bots[b-1]-1
-            else:
-                break
-    
-    # append fixes to err_cells dictionary
-    topandbots=[l1top]
-    for l in range(layers):
-        topandbots.append(bots[l])
-    err_cells[cell].append(topandbots)
-    
-    # apply fixes to elevation arrays
-    l1tops[err_cells[cell][0]-1,err_cells[cell][1]-1]=l1top
-    bots_rs[:,err_cells[cell][0]-1,err_cells[cell][1]-1]=np.array(bots)
-    
-# While we're at it, create new tops array for all layers
-tops=np.reshape(np.append(l1tops,bots_rs[:-1,:,:]),[4,800,800])
+# original top and bottoms at the error cells
+old=grid.elevations[:,err_r-1,err_c-1].copy()
 
-with file(l1topfile[:-4]+'_new.DAT','w') as outfile:
-    for layer in tops:
-        np.savetxt(outfile,layer,fmt='%.6e')
-outfile.close()   
+# fix cell bottoms and tops for cells with land surface above GHB stages:
+# clamp land surface to the GHB stage, then lower bottoms so that each layer is at least min_thickness thick
+new=old.copy()
+new[0]=np.minimum(new[0],err_stage)
+new=grid_utils.enforce_min_thickness(new,min_thickness)
+
+# apply fixes to elevation arrays
+grid.elevations[:,err_r-1,err_c-1]=new
+grid.reset()
+tops=grid.tops
+
+MFarray_utils.write_layers(l1topfile[:-4]+'_new.DAT',tops,fmt='%.6e')
+MFarray_utils.write_layers(botsfile[:-4]+'_new.DAT',grid.bots,fmt='%.6e')
 
-with file(botsfile[:-4]+'_new.DAT','w') as outfile:
-    for layer in bots_rs:
-        np.savetxt(outfile,layer,fmt='%.6e')
-outfile.close()
-    
 # Writeout all original and fixed cell elevations to output file
 
 ofp=open(GHBout,'w')
-ofp.write('row,column,layer,GHBstage,L1top')
-for l in range(layers):
-    ofp.write('L'+str(l+1)+'bot')
-ofp.write('newL1top')
-for l in range(layers):
-    ofp.write('newL'+str(l+1)+'bot')
-ofp.write('\n')
-
-for cell in err_cells.iterkeys():
-    ofp.write(','.join(map(str,err_cells[cell][:4])))
-    ofp.write(str(err_cells[cell][4][0]))
-    for l in range(layers):
-        ofp.write(','+str(err_cells[cell][4][l+1]))
-    ofp.write(str(err_cells[cell][5][0]))
-    for l in range(layers):
-        ofp.write(','+str(err_cells[cell][5][l+1]))    
-    ofp.write('\n')
+ofp.write('row,column,layer,GHBstage,L1top,'+','.join(['L'+str(l+1)+'bot' for l in range(layers)]))
+ofp.write(',newL1top,'+','.join(['newL'+str(l+1)+'bot' for l in range(layers)])+'\n')
+table=np.column_stack([err_r,err_c,err_l,np.where(np.isinf(err_stage),np.nan,err_stage),old.T,new.T])
+for line in table:
+    ofp.write('%d,%d,%d,' %tuple(line[:3])+','.join(map(str,line[3:]))+'\n')
 ofp.close()
-    
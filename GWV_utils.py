@@ -0,0 +1,162 @@
+'''
+Reads Groundwater Vistas matrix exports (*.DAT; whitespace-delimited text arrays)
+
+The text parse of a large matrix (e.g. 800x800x5) dominates the run time of scripts that use them,
+so each matrix is parsed once and saved as a binary .npy sidecar in a cache folder.
+Later loads memory-map the sidecar instead of re-parsing the text.
+
+Cache entries are invalidated when the size or modification time of the source file changes
+(and optionally its md5 hash). The cache folder is kept under a size limit by evicting
+the least recently used sidecars.
+
+usage:
+import GWV_utils
+bots = GWV_utils.load_matrix('BR_L1L5bot.DAT', shape=(5, 800, 800))
+'''
+import os
+import json
+import hashlib
+import numpy as np
+import io_utils
+
+# default cache settings
+cache_dir = '.gwv_cache' # created next to the source matrix
+max_cache_size = 2e9 # bytes; least recently used sidecars are removed beyond this
+
+
+def file_signature(filename, hash=False):
+    '''
+    returns dict of size and modification time for filename (plus md5 hexdigest if hash=True)
+    '''
+    st = os.stat(filename)
+    sig = {'size': st.st_size, 'mtime': st.st_mtime}
+    if hash:
+        md5 = hashlib.md5()
+        with open(filename, 'rb') as infile:
+            for block in iter(lambda: infile.read(2**20), b''):
+                md5.update(block)
+        sig['md5'] = md5.hexdigest()
+    return sig
+
+
+def _cache_folder(filename, cachedir=None):
+    # cache folder for a source matrix (default is cache_dir next to it)
+    if cachedir is None:
+        cachedir = os.path.join(os.path.dirname(os.path.abspath(filename)), cache_dir)
+    return cachedir
+
+
+def cache_paths(filename, dtype=np.float64, cachedir=None):
+    '''
+    returns paths to the .npy sidecar and .json metadata file for filename
+    sidecars are named after the source file, its absolute path (hashed), and the dtype
+    '''
+    filename = os.path.abspath(filename)
+    cachedir = _cache_folder(filename, cachedir)
+    key = hashlib.md5(filename.encode('utf-8')).hexdigest()[:12]
+    basename = '{}.{}.{}'.format(os.path.basename(filename), key, np.dtype(dtype).name)
+    return os.path.join(cachedir, basename + '.npy'), os.path.join(cachedir, basename + '.json')
+
+
+def _read_meta(metafile):
+    try:
+        with open(metafile) as infile:
+            return json.load(infile)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def load_matrix(filename, shape=None, dtype=np.float64, cachedir=None, mmap_mode='c',
+                hash=False, max_size=max_cache_size, use_cache=True):
+    '''
+    load a GWV matrix export, using the binary sidecar if it is current
+
+    filename: GWV matrix (text, whitespace delimited)
+    shape: optional shape to reshape the array to (e.g. (layers, rows, columns)); -1 is allowed
+    dtype: dtype for the returned array (sidecars are kept separately for each dtype)
+    cachedir: folder for sidecars (default is .gwv_cache next to filename)
+    mmap_mode: passed to np.load; default 'c' (copy-on-write) so that scripts can modify
+        the array in memory without touching the sidecar. None reads the sidecar into memory.
+    hash: also compare md5 of the source file when validating the sidecar
+        (catches edits that preserve size and mtime, but requires reading the source file)
+    max_size: size limit (bytes) for the cache folder
+    use_cache: False parses the text file without reading or writing sidecars
+    '''
+    if not use_cache:
+        arr = np.fromfile(filename, sep=' ').astype(dtype, copy=False)
+        return arr if shape is None else arr.reshape(shape)
+
+    npyfile, metafile = cache_paths(filename, dtype, cachedir)
+    sig = file_signature(filename, hash=hash)
+    meta = _read_meta(metafile)
+
+    if meta is not None and meta.get('source') == sig and os.path.exists(npyfile):
+        arr = np.load(npyfile, mmap_mode=mmap_mode)
+        os.utime(npyfile, None) # mark as recently used, for eviction
+    else:
+        arr = np.fromfile(filename, sep=' ').astype(dtype, copy=False)
+        cachedir = os.path.dirname(npyfile)
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        # write to temporary files first so that an interrupted run can't leave a bad sidecar
+        tmpfile = npyfile[:-4] + '.tmp.npy'
+        np.save(tmpfile, arr)
+        io_utils.replace_file(tmpfile, npyfile)
+        with open(metafile + '.tmp', 'w') as ofp:
+            json.dump({'source': sig, 'filename': os.path.abspath(filename),
+                       'dtype': np.dtype(dtype).name, 'size': arr.size}, ofp)
+        io_utils.replace_file(metafile + '.tmp', metafile)
+        evict(cachedir, max_size, keep=[npyfile])
+        if mmap_mode is not None:
+            arr = np.load(npyfile, mmap_mode=mmap_mode)
+
+    if shape is not None:
+        arr = arr.reshape(shape)
+    return arr
+
+
+def evict(cachedir, max_size=max_cache_size, keep=()):
+    '''
+    remove least recently used sidecars from cachedir until its total size is below max_size
+    (cachedir is the folder used by load_matrix, e.g. from os.path.dirname(cache_paths(filename)[0]))
+    files listed in keep are never removed; returns list of removed sidecars
+    '''
+    if not os.path.isdir(cachedir):
+        return []
+    keep = set(os.path.abspath(f) for f in keep)
+    entries = []
+    total = 0
+    for f in os.listdir(cachedir):
+        if not f.endswith('.npy'):
+            continue
+        path = os.path.abspath(os.path.join(cachedir, f))
+        st = os.stat(path)
+        total += st.st_size
+        entries.append((st.st_mtime, st.st_size, path))
+
+    removed = []
+    for mtime, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        if path in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError: # sidecar may still be memory-mapped (Windows)
+            continue
+        metafile = path[:-4] + '.json'
+        if os.path.exists(metafile):
+            os.remove(metafile)
+        total -= size
+        removed.append(path)
+    return removed
+
+
+def clear_cache(filename=None, cachedir=None):
+    '''
+    remove all sidecars and metadata files from the cache folder of filename (a source matrix;
+    default is .gwv_cache next to it, as in load_matrix), or from cachedir if given
+    '''
+    if filename is None and cachedir is None:
+        raise ValueError('specify the source matrix (filename) or the cache folder (cachedir)')
+    return evict(_cache_folder(filename, cachedir), max_size=-1)
@@ -2,206 +2,200 @@
 # Row, Column (header)
 # Row, Column (values; n lines for n cells)
 
-# Zone Budget output files are created in each MODFLOW run folder; selected Zone Budget results
-# and global Mass Bal. results are compiled into 'ZB_summary.out' in the same folder as Get_MB.py
+# Zone budgets are computed directly from the binary cbb files (see MFbinary_utils.py); selected Zone Budget results
+# and global Mass Bal. results are compiled into outfile in the same folder as Get_MB.py
 
-# polygon ij files and zonbud.exe must be in same folder as Get_MB.py
+# polygon ij files must be in same folder as Get_MB.py
 # MODFLOW runs (cbb files) should be in subfolders, within the same folder as Get_MB.py
 import os
-import numpy as np
 import shutil
+import traceback
+import multiprocessing
+import GWV_utils
+import zonbud_utils
+import MFbudget_utils
 
 outfile='20130315_runs_NWT_MB.out'
 createzon='no' # 'yes' to create zonbudget input files
+zonfile='polygons.zon' # zonbudget input file with a zone for each polygon ij file (polygons_2.zon etc. for overlapping polygons)
+zonenames_file='polygons_zones.csv' # zone number of each polygon
+processes=4 # maximum number of cbb/lst files processed at once (1 to process them one at a time in this process)
+cachefile='Get_MB_cache.json' # results from previous runs; only new or changed cbb/lst files are processed
+use_cache=True # False to process all files
 
 #MODFLOW model dimensions
 rows=261
 columns=277
 layers=15
 
-print 'finding polygon ij files and run folders...'
-allfiles=os.listdir(os.getcwd())
-plys = dict()
-cind=-1
-for cf in allfiles:
-    if cf.lower().endswith('.ij'):
-        cind = cind+1
-        plys[cind]=cf[:-3] 
-              
-all_subdirs = [d for d in os.listdir('.') if os.path.isdir(d)]
-all_subdirs = [all_subdirs for all_subdirs in all_subdirs if all_subdirs != 'NWT_files']
-all_subdirs = [all_subdirs for all_subdirs in all_subdirs if all_subdirs != 'Python27']
-
-all_subdirs = [all_subdirs for all_subdirs in all_subdirs if all_subdirs.endswith('NWT')]
-
-print 'creating zonebud input files...'
-
-if createzon=='yes':
-    for p in plys:
-	    outfile=plys[p]+'.zon'
-	    pcells=[]
-	    pinds=np.genfromtxt(plys[p]+'.ij',delimiter=',',names=True,dtype=None)
-	    for i in range(len(pinds)):
-		    prow=pinds[i][0]
-		    pcol=pinds[i][1]
-		    pcell=(prow-1)*columns+pcol
-		    pcells.append(pcell)
-	    pcells=np.array(pcells)
-	    
-	    # write zonbud input file cell by cell, row by row, layer by layer
-	    ofp=open(outfile,'w')
-	    ofp.write('%s %s %s\n' %(layers,rows,columns))
-		      
-	    for l in range(layers+1)[1:]:
-		    ofp.write('INTERNAL ('+str(columns)+'I2)\n')
-		    for r in range(rows):
-			    for c in range(columns):
-				    cellnum=r*columns+c+1
-				    intersect=np.where(pcells==cellnum)[0]
-				    # if cell is not within the polygon, assing to zone 0
-				    if len(intersect)==0:
-					    ofp.write('0 ')
-				    # otherwise assing to zone 1    
-				    else:
-					    ofp.write('1 ')
-			    ofp.write('\n')        
-	    ofp.close()
-	    for folder in all_subdirs:
-		    shutil.copy(outfile,folder)
-	    print outfile
-
-print 'running Zone Budget...'
-
-for folder in all_subdirs:
-    os.chdir(folder)
-    print "from folder "+ folder+'...'
-    allfiles=os.listdir(os.getcwd())
-    zons = dict()
-    cbbs = dict()
-    cind=-1
-    zind=-1
-    for cf in allfiles:
-        if cf.lower().endswith('.zon'):
-            zind=zind+1
-            zons[zind]=cf[:-4]
-        if cf.lower().endswith('.cbb'):
-            cind = cind+1
-            cbbs[cind]=cf[:-4]            
-    for n in range(len(cbbs)):
-        print 'Scenario '+ cbbs[n]
-        for z in range(len(zons)):
-            print 'running '+zons[z]
-            basename=cbbs[n]+'_'+zons[z]
-            respfile=basename+'_resp'
-            ofp=open(respfile,'w')
-            ofp.write(basename+'.zout\n')
-            ofp.write(cbbs[n]+'.cbb\n')
-            ofp.write(basename+'\n')
-            ofp.write(zons[z]+'.zon\n')
-            ofp.write('A\n')
-            ofp.close()
-            os.system("..\zonbud <" + respfile)
-            os.remove(respfile) # cleanup folder
-    os.remove(zons[z]+'.zon')
-    os.chdir('..')
-
-print 'Retrieving Zone Budget results...'  
-
-ofp=open(outfile,'w')
-ofp.write('Zone Budget Summary for Polygons\n')
-for folder in all_subdirs:
-    os.chdir(folder)
-    print folder
-    allfiles=os.listdir(os.getcwd())
-    zouts = dict()
-    lsts= dict()
-    cind=-1
-    zind=-1
-    for cf in allfiles:
-        if cf.lower().endswith('.zout'):
-            zind=zind+1
-            zouts[zind]=cf
-        if cf.lower().endswith('.lst'):
-            cind = cind+1
-            lsts[cind]=cf
-    
-    for n in range(len(zouts)):
-        print zouts[n]
-        ofp.write('Mass Balance Summary for ' + zouts[n]+'\n')
-        Nearfield=False
-        with open(zouts[n]) as infile:
-            for line in infile:
-                if 'Nearfield_mass_balance' in line:
-                    Nearfield=True
-		if 'Quarries' in line:
-			Quarries=True		    
-                if Nearfield==False:
-                    if 'IN:' in line:
-			In=True
-                        ofp.write(line)
-                    if 'CONSTANT HEAD' in line:
-                        ofp.write(line)
-			if In:
-			    CHDin=float(line.split()[3])
-			if Out:
-			    CHDout=float(line.split()[3])
-		    if 'DRAINS' in line:
-			ofp.write(line)
-			if In:
-				DRNin=float(line.split()[2])
-			if Out:
-				DRNout=float(line.split()[2])
-		    if 'RIVER LEAKAGE' in line:
-			ofp.write(line)
-			if In:
-			    RIVin=float(line.split()[3])
-			if Out:
-			    RIVout=float(line.split()[3])
-		    if 'OUT:' in line:
-			In=False
-			Out=True
-			ofp.write(line)
-		    if 'Discrepancy' in line:
-		    # we have reached the end of mass bal. info; print totals
-			ofp.write('\n')
-			ofp.write('Net fluxes for '+zouts[n]+'\n')
-			Qnet=CHDout-CHDin+DRNout
-			RIVnet=RIVout-RIVin
-			if Quarries:
-				ofp.write('Quarries = '+str(Qnet)+'\n')
-			ofp.write('Net flux to River Cells (Out-In) = '+str(RIVnet)+'\n')
-			ofp.write('\n')
-                elif Nearfield and 'Percent Discrepancy' in line:
-                    ofp.write('Nearfield Mass Bal. for '+ zouts[n]+ ' '+ line)
-	    Out=False   
-	    Quarries=False
-    
-    print 'Adding Global Mass Balance Discrepancies...'                    
-    for n in range(len(lsts)):
-        ofp.write('Global Mass Balance Discrepancy for '+lsts[n]+'\n')
-        with open(lsts[n]) as infile:
-            for line in infile:
-                if 'PERCENT DISCREPANCY' in line:
-                    ofp.write(line)
-                    print lsts[n]
-    os.chdir('..')
-ofp.close()
-                    
-                    
-        
-    
-    
-
-
-
-
-
-
-
-
-
-
 
+def find_runs(basedir):
+    '''
+    polygon names (from .ij files, sorted) and absolute paths of the MODFLOW run folders in basedir
+    '''
+    allfiles=sorted(os.listdir(basedir))
+    plys=[cf[:-3] for cf in allfiles if cf.lower().endswith('.ij')]
+    all_subdirs=[os.path.join(basedir,d) for d in allfiles if os.path.isdir(os.path.join(basedir,d))]
+    all_subdirs=[d for d in all_subdirs if os.path.basename(d) not in ['NWT_files','Python27']]
+    all_subdirs=[d for d in all_subdirs if d.endswith('NWT')]
+    return plys,all_subdirs
+
+
+def make_tasks(all_subdirs):
+    '''
+    list of (folder, file) for each cbb file and then each lst file in each folder, in summary order
+    '''
+    tasks=[]
+    for folder in all_subdirs:
+        allfiles=sorted(os.listdir(folder))
+        tasks+=[(folder,cf) for cf in allfiles if cf.lower().endswith('.cbb')]
+        tasks+=[(folder,cf) for cf in allfiles if cf.lower().endswith('.lst')]
+    return tasks
+
+
+# zone arrays and names, set once in each worker process by init_worker
+_zones=None
+_zonenames=None
+
+
+def init_worker(zones,zonenames):
+    global _zones,_zonenames
+    _zones=zones
+    _zonenames=zonenames
+
+
+def run_task(task):
+    '''
+    results for a (folder, file) task: zone budgets for a cbb file (as zonbud_utils.budgets_to_json),
+    or the global mass balance discrepancy for each time step in a lst file (see MFbudget_utils)
+
+    returns (task, result dict, None), or (task, None, error traceback) if the file couldn't be processed
+    '''
+    folder,filename=task
+    try:
+        if filename.lower().endswith('.cbb'):
+            budgets=zonbud_utils.zone_budgets(os.path.join(folder,filename),_zones)
+            return task,{'budgets':zonbud_utils.budgets_to_json(budgets)},None
+        lines=[]
+        disc=MFbudget_utils.read_lst_discrepancy(os.path.join(folder,filename))
+        for kstp,kper,cumulative,rate in disc[['kstp','kper','cumulative','rate']].values.tolist():
+            lines.append('time step %d, stress period %d: PERCENT DISCREPANCY = %s (cumulative), %s (rates)\n' %(kstp,kper,cumulative,rate))
+        return task,{'lines':lines},None
+    except Exception:
+        return task,None,traceback.format_exc()
+
+
+def write_result(ofp,filename,result,zonenames):
+    '''
+    write the summary for a run_task result
+    '''
+    if 'budgets' in result:
+        ofp.write('Mass Balance Summary for ' + filename +'\n')
+        budgets=zonbud_utils.budgets_from_json(result['budgets'])
+        zonbud_utils.write_summary(ofp,budgets,zonenames,filename[:-4])
+    else:
+        ofp.write('Global Mass Balance Discrepancy for '+filename+'\n')
+        for line in result['lines']:
+            ofp.write(line)
+
+
+def run_tasks(tasks,zones,zonenames,processes=processes):
+    '''
+    generator of run_task results, in the order of tasks, from a pool of up to processes workers
+    '''
+    if processes<=1 or len(tasks)<=1:
+        init_worker(zones,zonenames)
+        for task in tasks:
+            yield run_task(task)
+        return
+    pool=multiprocessing.Pool(processes,init_worker,(zones,zonenames))
+    try:
+        for result in pool.imap(run_task,tasks):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__=='__main__':
+    basedir=os.getcwd()
+
+    print 'finding polygon ij files and run folders...'
+    plys,all_subdirs=find_runs(basedir)
+
+    # zone n is polygon n (see zonenames_file); zone 0 is outside of the polygons
+    # polygons that share cells are in separate zone arrays, so that each gets its whole budget
+    ijfiles=[os.path.join(basedir,p+'.ij') for p in plys]
+    zones=zonbud_utils.build_zones(ijfiles,layers,rows,columns)
+    if len(zones)>1:
+        print 'overlapping polygons; zone budgets computed for %s separate zone arrays' %(len(zones))
+    if createzon=='yes':
+        # one zone file for each zone array, for running zonbud.exe outside of this script
+        print 'creating zonebud input files...'
+        for g in range(len(zones)):
+            zfile=zonfile if g==0 else '%s_%s%s' %(zonfile[:-4],g+1,zonfile[-4:])
+            zonbud_utils.write_zon(os.path.join(basedir,zfile),zones[g])
+            for folder in all_subdirs:
+                shutil.copy(os.path.join(basedir,zfile),folder)
+            print zfile
+    ofp=open(os.path.join(basedir,zonenames_file),'w')
+    ofp.write('zone,polygon\n')
+    for p in range(len(plys)):
+        ofp.write('%s,%s\n' %(p+1,plys[p]))
+    ofp.close()
+    zonenames=dict([(p+1,plys[p]) for p in range(len(plys))])
+
+    print 'computing Zone Budgets...'
+    tasks=make_tasks(all_subdirs)
+    cache=dict()
+    if use_cache:
+        cache=zonbud_utils.load_cache(os.path.join(basedir,cachefile))
+    zhash=zonbud_utils.zones_hash(zones)
+    # signatures are taken before processing, so that files written during this run are redone next time
+    sigs=dict()
+    results=dict()
+    for task in tasks:
+        folder,filename=task
+        sigs[task]=GWV_utils.file_signature(os.path.join(folder,filename))
+        entry=zonbud_utils.cached_entry(cache,os.path.join(folder,filename),
+                                        zhash if filename.lower().endswith('.cbb') else None)
+        if entry is not None:
+            results[task]=entry['result']
+    print '%s of %s cbb/lst files unchanged since the last run' %(len(results),len(tasks))
+
+    failed=dict()
+    for (folder,filename),result,error in run_tasks([t for t in tasks if t not in results],zones,zonenames):
+        print os.path.basename(folder)+': '+filename
+        if error is not None:
+            failed.setdefault(folder,[]).append((filename,error))
+            continue
+        results[(folder,filename)]=result
+
+    # assemble the summary in folder/file order from cached and new results
+    ofp=open(os.path.join(basedir,outfile),'w')
+    ofp.write('Zone Budget Summary for Polygons\n')
+    newcache=dict()
+    for folder,filename in tasks:
+        path=os.path.abspath(os.path.join(folder,filename))
+        if (folder,filename) not in results:
+            error=[e for f,e in failed[folder] if f==filename][0]
+            ofp.write('Failed to process '+filename+' in '+os.path.basename(folder)+': '+error.strip().splitlines()[-1]+'\n')
+            continue
+        write_result(ofp,filename,results[(folder,filename)],zonenames)
+        newcache[path]={'source':sigs[(folder,filename)],'result':results[(folder,filename)]}
+        if filename.lower().endswith('.cbb'):
+            newcache[path]['zones']=zhash
+    ofp.close()
+    if use_cache:
+        zonbud_utils.save_cache(newcache,os.path.join(basedir,cachefile))
+
+    if len(failed)>0:
+        print '\nfailures in %s of %s run folders:' %(len(failed),len(all_subdirs))
+        for folder in sorted(failed.keys()):
+            print folder
+            for filename,error in failed[folder]:
+                print '  '+filename+':'
+                print '    '+error.strip().replace('\n','\n    ')
 
 '''print 'getting folder names...'
 all_subdirs = [d for d in os.listdir('.') if os.path.isdir(d)]
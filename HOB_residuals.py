@@ -0,0 +1,59 @@
+# Program to compute simulated equivalents and residuals for head observations in a MODFLOW-2005 HOB file
+# (such as written by createHOBs.py), directly from the binary head file of a model run.
+# The model does not need to be run with the Observation Process.
+
+# Heads are interpolated within each layer from the observation cell and its neighbors using the
+# ROFF/COFF offsets, and averaged over layers using the PR fractions (see HOB_utils.simulated_heads).
+# Residuals are computed at the time of each observation (start of stress period IREFSP + TOFFSET x TOMULTH),
+# interpolated between the saved times before and after it (see HOB_utils.simulated_at_observation_times).
+
+# Output is a csv file with: obsname,IREFSP,TOFFSET,totim,observed,simulated,residual (observed - simulated)
+# and (optionally) a csv file of the simulated equivalents at every saved time: obsname,kstp,kper,totim,simulated
+
+import numpy as np
+import HOB_utils
+import MFbinary_utils
+
+# Input files
+HOBfile='BadRiver.hob'
+hdsfile='BadRiver.hds'
+DISfile=None # optional; stress period lengths locate observations in stress periods without saved heads
+
+# Settings
+hnoflo=1e30 # head assigned to inactive cells (HNOFLO in the BAS file)
+hdry=-1e30 # head assigned to dry cells (HDRY in the LPF/UPW file)
+
+# Outputfiles
+outfile='BadRiver_HOB_residuals.csv'
+simfile='BadRiver_HOB_simulated_all_times.csv' # None to skip the table of every saved time
+
+print "reading %s and %s..." %(HOBfile,hdsfile)
+hds=MFbinary_utils.HeadFile(hdsfile)
+obs=HOB_utils.read_hob(HOBfile,nlay=hds.nlay)
+perlen=None
+if DISfile is not None:
+    import DIS_utils
+    perlen=DIS_utils.read_dis(DISfile)['perlen']
+
+print "interpolating heads for %s observations at %s times..." %(len(obs['obsname']),len(hds.kstpkper))
+sim=HOB_utils.simulated_heads(obs,hds,hnoflo=hnoflo,hdry=hdry)
+times,sim_obs=HOB_utils.simulated_at_observation_times(obs,sim,hds,perlen=perlen)
+residuals=obs['HOBS']-sim_obs
+
+ofp=open(outfile,'w')
+ofp.write('obsname,IREFSP,TOFFSET,totim,observed,simulated,residual\n')
+ofp.write(''.join(['%s,%s,%s,%s,%s,%s,%s\n' %(obs['obsname'][i],obs['IREFSP'][i],obs['TOFFSET'][i],times[i],obs['HOBS'][i],sim_obs[i],residuals[i])
+                   for i in range(len(obs['obsname']))]))
+ofp.close()
+
+if simfile is not None:
+    ofp=open(simfile,'w')
+    ofp.write('obsname,kstp,kper,totim,simulated\n')
+    for t,(kstp,kper) in enumerate(hds.kstpkper):
+        ofp.write(''.join(['%s,%s,%s,%s,%s\n' %(obs['obsname'][i],kstp,kper,hds.times[t],sim[t,i])
+                           for i in range(len(obs['obsname']))]))
+    ofp.close()
+
+nodata=np.isnan(sim_obs).sum()
+print "%s observations with no simulated head at their time (inactive or dry cells, or outside of the saved times)" %(nodata)
+print "results written to %s" %(outfile)
@@ -0,0 +1,346 @@
+'''
+Utilities for building MODFLOW-2005 Observation Process (HOB) input, and for computing
+simulated equivalents for HOB observations directly from binary head files
+See MF2005 Observation Process instructions for information on variable names
+
+reading .xlsx targets requires openpyxl; .xls requires xlrd
+'''
+import os
+import csv
+import numpy as np
+import io_utils
+import grid_utils
+import MFbinary_utils
+
+
+def layer_variables(PR, MAXM=2):
+    '''
+    HOB LAYER variable for each observation, and the MOBS and MAXM counts, from a
+    (n_obs, nlay) matrix of layer fractions (see grid_utils.screen_fractions)
+
+    LAYER is the (1-based) layer number for observations in one layer,
+    or -(number of layers) for observations spanning multiple layers
+    MOBS is the number of multi-layer observations
+    MAXM is the maximum number of layers spanned by an observation (at least MAXM)
+
+    returns LAYER, MOBS, MAXM
+    '''
+    PR = np.atleast_2d(PR)
+    nlayers = (PR > 0).sum(axis=1)
+    multilayer = nlayers > 1
+    LAYER = np.where(multilayer, -nlayers, PR.argmax(axis=1) + 1)
+    MOBS = int(multilayer.sum())
+    if len(nlayers) > 0:
+        MAXM = max(MAXM, int(nlayers.max()))
+    return LAYER, MOBS, MAXM
+
+
+def read_targets(filename, chunksize=10000, skip_header=1):
+    '''
+    read head targets in chunks of at most chunksize rows, from a .csv, .xlsx (read-only mode) or .xls file
+
+    columns should be: Name,x,y,water level,screen top elevation,screen bottom elevation
+    (after skip_header header lines; blank rows are skipped)
+
+    yields (obsname, x, y, WL, sctop, scbot) for each chunk; obsname is a list, the others are float arrays
+    '''
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.csv':
+        infile = open(filename)
+        rows = csv.reader(infile)
+        close = infile.close
+    elif ext in ['.xlsx', '.xlsm']:
+        from openpyxl import load_workbook
+        wb = load_workbook(filename, read_only=True, data_only=True)
+        rows = ([c.value for c in row] for row in wb.worksheets[0].iter_rows())
+        close = getattr(wb, 'close', lambda: None) # read-only workbooks keep the file open
+    elif ext == '.xls':
+        from xlrd import open_workbook
+        wb = open_workbook(filename, on_demand=True)
+        sheet = wb.sheet_by_index(0)
+        rows = (sheet.row_values(i) for i in range(sheet.nrows))
+        close = wb.release_resources
+    else:
+        raise ValueError('unrecognized file type for head targets: {}'.format(filename))
+
+    # the file is closed when the generator finishes, raises, or is closed (or garbage collected) early
+    try:
+        chunk = []
+        for i, row in enumerate(rows):
+            if i < skip_header or len(row) == 0 or row[0] in (None, ''):
+                continue
+            chunk.append(row[:6])
+            if len(chunk) == chunksize:
+                yield _targets_chunk(chunk)
+                chunk = []
+        if len(chunk) > 0:
+            yield _targets_chunk(chunk)
+    finally:
+        close()
+
+
+def _targets_chunk(rows):
+    obsname = [str(r[0]).strip() for r in rows]
+    values = np.array([r[1:6] for r in rows], dtype=float)
+    return [obsname] + [values[:, j] for j in range(5)]
+
+
+def write_hob(targets, grid, HOBfile, culled_targets=None, IUHOBSV=500, HOBDRY='NaN', TOMULTH=0,
+              IREFSP=1, TOFFSET=1):
+    '''
+    write a MODFLOW-2005 HOB file from chunks of head targets (see read_targets), one chunk at a time
+
+    targets outside of the model grid are skipped; the (NH, MOBS, MAXM) counts in the header are
+    filled in after the last chunk has been written, so memory use depends only on the chunk size
+
+    targets: iterable of (obsname, x, y, WL, sctop, scbot) chunks
+    grid: grid_utils.ModelGrid instance with elevations and grid location information
+    culled_targets: optional file to write Name,WL for each target within the model domain
+
+    returns NH, MOBS, MAXM
+    '''
+    NH, MOBS, MAXM = 0, 0, 2
+    # files are written under temporary names and renamed at the end, so that a failure
+    # (e.g. a screen outside of the model layers) doesn't leave a truncated HOB file
+    outfiles = [HOBfile] if culled_targets is None else [HOBfile, culled_targets]
+    ofp2 = None
+    try:
+        with open(HOBfile + '.tmp', 'w') as ofp:
+            if culled_targets is not None:
+                ofp2 = open(culled_targets + '.tmp', 'w')
+            ofp.write('# HOBs file created by createHOBs.py\n')
+            header_pos = ofp.tell()
+            header_len = 3 * 11 + len('{} {}\n'.format(IUHOBSV, HOBDRY)) # room for NH, MOBS, MAXM
+            ofp.write(' ' * (header_len - 1) + '\n')
+            ofp.write('{}\n'.format(TOMULTH))
+
+            for obsname, x, y, WL, sctop, scbot in targets:
+                # cull to model domain and locate within grid (horizontal offset coefficents for obs process)
+                row, column, ROFF, COFF, inside = grid.locate(x, y)
+                inds = np.where(inside)[0]
+                row, column, ROFF, COFF = row[inds], column[inds], ROFF[inds], COFF[inds]
+
+                # vertical averaging coeffcients for water level (fraction of screen in each layer)
+                PR = grid_utils.screen_fractions(sctop[inds], scbot[inds], grid.elevations[:, row - 1, column - 1].T,
+                                                 names=[obsname[i] for i in inds])
+                outside = np.where(PR.sum(axis=1) == 0)[0]
+                if len(outside) > 0:
+                    raise ValueError('Screened interval outside of model layers for ' +
+                                     ', '.join([obsname[inds[t]] for t in outside]))
+                layer, nmulti, MAXM = layer_variables(PR, MAXM)
+                NH += len(inds)
+                MOBS += nmulti
+
+                lines = []
+                for t, i in enumerate(inds):
+                    lines.append('%s %s %s %s %s %s %s %s %s\n' % (obsname[i], layer[t], row[t], column[t],
+                                                               IREFSP, TOFFSET, ROFF[t], COFF[t], WL[i]))
+                    if layer[t] < 0:
+                        for l in np.where(PR[t] > 0)[0]:
+                            lines.append('%s,%s\n' % (l + 1, PR[t, l]))
+                ofp.write(''.join(lines))
+                if ofp2 is not None:
+                    ofp2.write(''.join(['%s,%s\n' % (obsname[i], WL[i]) for i in inds]))
+
+            # fill in the header counts
+            ofp.seek(header_pos)
+            ofp.write('{} {} {} {} {}'.format(NH, MOBS, MAXM, IUHOBSV, HOBDRY).ljust(header_len - 1))
+    except Exception:
+        if ofp2 is not None:
+            ofp2.close()
+        for f in outfiles:
+            if os.path.exists(f + '.tmp'):
+                os.remove(f + '.tmp')
+        raise
+    if ofp2 is not None:
+        ofp2.close()
+    for f in outfiles:
+        io_utils.replace_file(f + '.tmp', f)
+    return NH, MOBS, MAXM
+
+
+def read_hob(HOBfile, nlay=None):
+    '''
+    read head observations from a MODFLOW-2005 HOB file (such as written by write_hob)
+
+    observations at multiple times (negative IREFSP) are listed once for each time, with the location
+    information repeated
+
+    nlay: number of model layers (columns in PR); default is the deepest layer referenced in the file
+
+    returns dict of obsname (list), and arrays of layer, row, column, IREFSP, TOFFSET, ROFF, COFF and HOBS,
+    PR, the (n_obs, nlay) matrix of layer fractions (1 in the observation layer for single-layer observations),
+    and TOMULTH (the time offset multiplier)
+    '''
+    with open(HOBfile) as infile:
+        tokens = [line.replace(',', ' ').split() for line in infile if not line.strip().startswith('#')]
+    tokens = [t for line in tokens for t in line]
+    NH = int(tokens[0])
+    pos = 6 if tokens[5].upper() == 'NOPRINT' else 5
+    TOMULTH = float(tokens[pos].replace('d', 'e').replace('D', 'E'))
+    pos += 1
+
+    obs = dict((k, []) for k in ['obsname', 'layer', 'row', 'column', 'IREFSP', 'TOFFSET', 'ROFF', 'COFF', 'HOBS'])
+    layers = []
+    n = 0
+    while n < NH:
+        obsname, layer, row, column, irefsp, toffset, roff, coff, hobs = tokens[pos:pos + 9]
+        pos += 9
+        layer, irefsp = int(layer), int(irefsp)
+        if layer < 0:
+            pairs = tokens[pos:pos - 2 * layer]
+            pos += -2 * layer
+            mlay = dict((int(pairs[i]), float(pairs[i + 1])) for i in range(0, len(pairs), 2))
+        else:
+            mlay = {layer: 1.}
+        if irefsp < 0:
+            # ITT, then OBSNAM IREFSP TOFFSET HOBS for each time
+            ntimes = -irefsp
+            pos += 1
+            times = [tokens[pos + 4 * i:pos + 4 * (i + 1)] for i in range(ntimes)]
+            pos += 4 * ntimes
+        else:
+            times = [(obsname, irefsp, toffset, hobs)]
+        for obsname, irefsp, toffset, hobs in times:
+            for k, v in zip(['obsname', 'layer', 'row', 'column', 'IREFSP', 'TOFFSET', 'ROFF', 'COFF', 'HOBS'],
+                            [obsname, layer, row, column, irefsp, toffset, roff, coff, hobs]):
+                obs[k].append(v)
+            layers.append(mlay)
+            n += 1
+
+    for k in ['layer', 'row', 'column', 'IREFSP']:
+        obs[k] = np.array(obs[k], dtype=int)
+    for k in ['TOFFSET', 'ROFF', 'COFF', 'HOBS']:
+        obs[k] = np.array(obs[k], dtype=float)
+    if nlay is None:
+        nlay = max([max(m.keys()) for m in layers] + [1])
+    obs['PR'] = np.zeros((len(layers), nlay))
+    for i, mlay in enumerate(layers):
+        for l, pr in mlay.items():
+            obs['PR'][i, l - 1] = pr
+    obs['TOMULTH'] = TOMULTH
+    return obs
+
+
+def interpolation_weights(row, column, ROFF, COFF, nrow, ncol):
+    '''
+    cells and bilinear weights for interpolating heads at observation locations, from the HOB
+    ROFF/COFF offsets (ROFF positive in the direction of increasing row, as in grid_utils.locate_points)
+
+    returns (n_obs, 4) arrays of 0-based rows, columns, and weights for the observation cell and
+    its neighbors in the row, column, and diagonal directions; neighbors outside the grid get zero weight
+    '''
+    r0, c0 = np.asarray(row) - 1, np.asarray(column) - 1
+    r1 = r0 + np.sign(ROFF).astype(int)
+    c1 = c0 + np.sign(COFF).astype(int)
+    ar, ac = np.abs(ROFF), np.abs(COFF)
+    R = np.column_stack([r0, r1, r0, r1])
+    C = np.column_stack([c0, c0, c1, c1])
+    W = np.column_stack([(1 - ar) * (1 - ac), ar * (1 - ac), (1 - ar) * ac, ar * ac])
+    inside = (R >= 0) & (R < nrow) & (C >= 0) & (C < ncol)
+    return np.where(inside, R, 0), np.where(inside, C, 0), np.where(inside, W, 0.)
+
+
+def simulated_heads(obs, hds, hnoflo=1e30, hdry=-1e30, chunksize=100):
+    '''
+    simulated equivalents for head observations at each time saved in a binary head file
+
+    heads are interpolated bilinearly within each layer using the ROFF/COFF offsets (see interpolation_weights),
+    and averaged over layers using the PR fractions; cells that are inactive (hnoflo), dry (hdry), or not saved
+    are left out, and the remaining weights renormalized (nan if no cells remain)
+
+    obs: observations from read_hob
+    hds: MFbinary_utils.HeadFile instance, or head filename
+    chunksize: number of times gathered from the head file at once
+
+    returns (ntimes, n_obs) array of simulated heads; times are listed in hds.kstpkper and hds.times
+    '''
+    if not isinstance(hds, MFbinary_utils.HeadFile):
+        hds = MFbinary_utils.HeadFile(hds)
+    PR = obs['PR'][:, :hds.nlay]
+    R, C, W = interpolation_weights(obs['row'], obs['column'], obs['ROFF'], obs['COFF'], hds.nrow, hds.ncol)
+
+    # (observation, layer) pairs with part of the screen in the layer
+    iobs, lay = np.nonzero(PR)
+    pr = PR[iobs, lay]
+    R, C, W = R[iobs], C[iobs], W[iobs]
+
+    ntimes = len(hds.kstpkper)
+    sim = np.empty((ntimes, PR.shape[0]))
+    for t0 in range(0, ntimes, chunksize):
+        idx = np.arange(t0, min(t0 + chunksize, ntimes))
+        h = hds.get_values(lay[:, None], R, C, idx=idx) # (times, pairs, 4)
+        valid = np.isfinite(h) & ~np.isclose(h, hnoflo, rtol=1e-6) & ~np.isclose(h, hdry, rtol=1e-6)
+        w = np.where(valid, W, 0.)
+        wsum = w.sum(axis=2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            hlay = (np.where(valid, h, 0.) * w).sum(axis=2) / wsum
+        prw = np.where(wsum > 0, pr, 0.)
+        num = np.zeros((len(idx), PR.shape[0]))
+        den = np.zeros((len(idx), PR.shape[0]))
+        np.add.at(num, (slice(None), iobs), np.where(wsum > 0, hlay, 0.) * prw)
+        np.add.at(den, (slice(None), iobs), prw)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sim[idx] = np.where(den > 0, num / den, np.nan)
+    return sim
+
+
+def observation_times(obs, hds, perlen=None):
+    '''
+    simulation time (totim) of each observation: the start of stress period IREFSP plus TOFFSET * TOMULTH
+
+    obs: observations from read_hob
+    hds: MFbinary_utils.HeadFile instance
+    perlen: optional stress period lengths (e.g. dis['perlen'] from DIS_utils.read_dis); by default the start
+        of each stress period is taken from the head file (totim - pertim), and observations in stress periods
+        without saved heads get nan
+    '''
+    if perlen is not None:
+        starts = np.append(0., np.cumsum(perlen))
+    else:
+        starts = np.empty(max(rec['kper'] for rec in hds.records))
+        starts.fill(np.nan)
+        for rec in hds.records:
+            starts[rec['kper'] - 1] = rec['totim'] - rec['pertim']
+    per = obs['IREFSP'] - 1
+    known = (per >= 0) & (per < len(starts))
+    times = np.empty(len(per))
+    times.fill(np.nan)
+    times[known] = starts[per[known]] + obs['TOFFSET'][known] * obs.get('TOMULTH', 1.)
+    return times
+
+
+def simulated_at_observation_times(obs, sim, hds, perlen=None):
+    '''
+    simulated equivalent of each observation at its own time (see observation_times), interpolated linearly
+    between the saved times before and after it
+
+    obs: observations from read_hob
+    sim: (ntimes, n_obs) simulated heads at the saved times (from simulated_heads)
+    hds: MFbinary_utils.HeadFile instance
+    perlen: optional stress period lengths (see observation_times)
+
+    observations before the first saved time get the heads at that time if it is in the same stress period
+    (e.g. a steady-state first period; initial heads aren't in the head file); observations after the last
+    saved time, or with unknown times, get nan
+
+    returns arrays of observation times, and simulated equivalents
+    '''
+    times = observation_times(obs, hds, perlen)
+    saved = np.asarray(hds.times, dtype=float)
+    ntimes, nobs = len(saved), len(times)
+    cols = np.arange(nobs)
+    known = ~np.isnan(times)
+    after = np.searchsorted(saved, np.where(known, times, np.inf))
+    after = np.minimum(after, ntimes - 1)
+    before = np.maximum(after - 1, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w = np.where(after > before, (times - saved[before]) / (saved[after] - saved[before]), 1.)
+    w = np.clip(w, 0., 1.)
+    # weights of exactly 0 or 1 use a single time, so that nan at the other time doesn't carry over
+    sim_obs = np.where(w == 1., sim[after, cols], np.where(w == 0., sim[before, cols],
+                                                            (1 - w) * sim[before, cols] + w * sim[after, cols]))
+    first = known & (times < saved[0])
+    sim_obs[first & (obs['IREFSP'] != hds.kstpkper[0][1])] = np.nan
+    sim_obs[~known | (times > saved[-1] + 1e-6 * abs(saved[-1]))] = np.nan # allow for single precision totim
+    return times, sim_obs
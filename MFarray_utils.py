@@ -0,0 +1,102 @@
+'''
+Writers for MODFLOW and Groundwater Vistas array input (text matrices, INTERNAL and CONSTANT
+array control records, and OPEN/CLOSE binary arrays)
+
+Text layers are formatted with a single string formatting operation per layer, instead of one per row
+(np.savetxt), and the output is byte-identical to np.savetxt with the same fmt, delimiter and newline.
+Large stacks can optionally be formatted in parallel, one layer per worker process.
+
+usage:
+import MFarray_utils
+MFarray_utils.write_layers('BR_L1L5bot_new.DAT', grid.bots, fmt='%.6e')
+'''
+import multiprocessing
+import numpy as np
+import MFbinary_utils
+
+
+def format_layer(layer, fmt='%.6e', delimiter=' ', newline='\n'):
+    '''
+    text for a 2D array, the same as np.savetxt(fmt=fmt, delimiter=delimiter, newline=newline) writes
+    (1D arrays are written one value per line, also as in np.savetxt)
+    '''
+    layer = np.asarray(layer)
+    if layer.ndim == 1:
+        layer = layer.reshape(-1, 1)
+    nrow, ncol = layer.shape
+    rowfmt = delimiter.join([fmt] * ncol) + newline
+    return (rowfmt * nrow) % tuple(layer.ravel().tolist())
+
+
+def _format_layer(args):
+    # for multiprocessing.Pool.imap (one argument)
+    return format_layer(*args)
+
+
+def _control_text(layer, control, constant, constant_fmt):
+    # (control record text, True if the layer is written as a CONSTANT record)
+    if constant and layer.size > 0 and np.all(layer == layer.flat[0]):
+        return 'CONSTANT ' + constant_fmt % layer.flat[0] + '\n', True
+    if control is None:
+        return '', False
+    return control + '\n', False
+
+
+def write_layers(f, layers, fmt='%.6e', delimiter=' ', newline='\n', control=None,
+                 constant=False, constant_fmt='%s', processes=1):
+    '''
+    write a 2D array, or a stack of 2D arrays (nlay, nrow, ncol) one layer at a time
+
+    f: filename or open file (text is appended at the current position)
+    fmt, delimiter, newline: as in np.savetxt
+    control: optional array control record written before each layer (e.g. 'INTERNAL 1.0 (FREE) -1')
+    constant: write layers with a single value as a CONSTANT record (formatted with constant_fmt)
+        instead of the control record and array
+    processes: number of worker processes for formatting the layers (1 formats in this process);
+        scripts using more than one process need an if __name__ == '__main__' guard (Windows)
+    '''
+    layers = np.asarray(layers)
+    if layers.ndim < 3:
+        layers = layers[np.newaxis]
+    ofp = open(f, 'w') if isinstance(f, str) else f
+
+    controls = [_control_text(layer, control, constant, constant_fmt) for layer in layers]
+    args = [(layer, fmt, delimiter, newline) for layer, (c, isconstant) in zip(layers, controls) if not isconstant]
+    if processes > 1 and len(args) > 1:
+        pool = multiprocessing.Pool(min(processes, len(args)))
+        texts = pool.imap(_format_layer, args)
+    else:
+        pool = None
+        texts = (format_layer(*a) for a in args)
+    try:
+        for c, isconstant in controls:
+            ofp.write(c)
+            if not isconstant:
+                ofp.write(next(texts))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if ofp is not f:
+            ofp.close()
+
+
+def write_binary(filename, layer, text='HEAD', precision='single', kstp=1, kper=1, pertim=1., totim=1., ilay=1,
+                 cnstnt=1., iprn=-1):
+    '''
+    write a 2D array as a MODFLOW binary array file (header record followed by the values, as in
+    binary head files), for input with an OPEN/CLOSE control record
+
+    returns the OPEN/CLOSE control record for the file
+    '''
+    layer = np.atleast_2d(layer)
+    real = MFbinary_utils._realtype(precision)
+    header = np.zeros(1, dtype=MFbinary_utils._head_header(real))
+    header['kstp'], header['kper'], header['pertim'], header['totim'] = kstp, kper, pertim, totim
+    header['text'] = text.rjust(16).encode('ascii')
+    header['nrow'], header['ncol'] = layer.shape
+    header['ilay'] = ilay
+    with open(filename, 'wb') as ofp:
+        ofp.write(header.tobytes())
+        ofp.write(np.ascontiguousarray(layer, dtype=real).tobytes())
+    return 'OPEN/CLOSE {} {} (BINARY) {}'.format(filename, cnstnt, iprn)
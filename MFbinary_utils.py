@@ -0,0 +1,368 @@
+'''
+Readers for MODFLOW binary output files
+
+CellBudgetFile reads MODFLOW-2005 style cell-by-cell budget (.cbb) files, in the full-array
+(non-compact) format written by default, and in the compact (COMPACT BUDGET) format with
+any of the array, list, and layer-indicator methods. HeadFile reads binary head (or drawdown) files.
+Single and double precision files are detected.
+The files are memory-mapped and indexed once; records are read directly from their offsets.
+
+usage:
+import MFbinary_utils
+cbb = MFbinary_utils.CellBudgetFile('model.cbb')
+budget = MFbinary_utils.zone_budget(cbb, zones) # zones: integer array, same shape as the model
+hds = MFbinary_utils.HeadFile('model.hds')
+heads = hds.get_data(hds.kstpkper[-1])
+'''
+import numpy as np
+
+_header = [('kstp', '<i4'), ('kper', '<i4'), ('text', 'S16'), ('ncol', '<i4'), ('nrow', '<i4'), ('nlay', '<i4')]
+
+# face flow terms, and the offset of the neighboring cell (layer, row, column) that each flow goes to
+face_terms = {'FLOW RIGHT FACE': (0, 0, 1),
+              'FLOW FRONT FACE': (0, 1, 0),
+              'FLOW LOWER FACE': (1, 0, 0)}
+
+
+def _realtype(precision):
+    return np.dtype('<f4') if precision == 'single' else np.dtype('<f8')
+
+
+def _index_file(index, precision, filename, kind):
+    '''
+    records from index(precision), and the precision; if precision is None, single and then double
+    precision are tried (index raises ValueError for records that don't fit the precision)
+    '''
+    if precision is not None:
+        return index(precision), precision
+    for precision in ['single', 'double']:
+        try:
+            return index(precision), precision
+        except ValueError:
+            continue
+    raise ValueError('could not read {} as a single or double precision {} file'.format(filename, kind))
+
+
+class CellBudgetFile(object):
+    '''
+    cbbfile: MODFLOW cell-by-cell budget file
+    precision: 'single', 'double', or None to detect
+
+    records is a list of dicts with kstp, kper, text, ncol, nrow, nlay, imeth, and the
+    information needed to read the record's data
+    '''
+    def __init__(self, cbbfile, precision=None):
+        self.filename = cbbfile
+        self.data = np.memmap(cbbfile, dtype=np.uint8, mode='r')
+        self.records, self.precision = _index_file(self._index, precision, cbbfile, 'budget')
+        self.realtype = _realtype(self.precision)
+
+    def _read(self, dtype, offset, count=1):
+        dtype = np.dtype(dtype)
+        if offset + dtype.itemsize * count > len(self.data):
+            raise ValueError('record extends past end of file')
+        return np.frombuffer(self.data, dtype=dtype, count=count, offset=offset)
+
+    def _index(self, precision):
+        real = _realtype(precision)
+        records = []
+        pos = 0
+        size = len(self.data)
+        while pos < size:
+            h = self._read(_header, pos)[0]
+            try:
+                text = h['text'].decode('ascii').strip()
+            except UnicodeDecodeError:
+                raise ValueError('invalid budget record text at byte {}'.format(pos))
+            rec = {'kstp': int(h['kstp']), 'kper': int(h['kper']), 'text': text,
+                   'ncol': int(h['ncol']), 'nrow': int(h['nrow']), 'nlay': int(h['nlay'])}
+            if rec['ncol'] <= 0 or rec['nrow'] <= 0 or rec['nlay'] == 0 or not all(32 <= ord(c) < 127 for c in text):
+                raise ValueError('invalid budget record header at byte {}'.format(pos))
+            pos += 36
+            ncell2d = rec['ncol'] * rec['nrow']
+            if rec['nlay'] > 0:
+                rec['imeth'] = 0
+                rec['offset'] = pos
+                pos += ncell2d * rec['nlay'] * real.itemsize
+            else:
+                rec['nlay'] = -rec['nlay']
+                h2 = self._read([('imeth', '<i4'), ('delt', real), ('pertim', real), ('totim', real)], pos)[0]
+                rec['imeth'] = int(h2['imeth'])
+                rec['totim'] = float(h2['totim'])
+                pos += 4 + 3 * real.itemsize
+                nval = 1
+                if rec['imeth'] == 5:
+                    nval = int(self._read('<i4', pos)[0])
+                    pos += 4 + 16 * (nval - 1)
+                rec['nval'] = nval
+                if rec['imeth'] in (2, 5):
+                    nlist = int(self._read('<i4', pos)[0])
+                    pos += 4
+                    rec['nlist'] = nlist
+                    rec['offset'] = pos
+                    pos += nlist * (4 + nval * real.itemsize)
+                elif rec['imeth'] == 1:
+                    rec['offset'] = pos
+                    pos += ncell2d * rec['nlay'] * real.itemsize
+                elif rec['imeth'] == 3:
+                    rec['offset'] = pos
+                    pos += ncell2d * (4 + real.itemsize)
+                elif rec['imeth'] == 4:
+                    rec['offset'] = pos
+                    pos += ncell2d * real.itemsize
+                else:
+                    raise ValueError('unsupported budget method {} at byte {}'.format(rec['imeth'], pos))
+            if pos > size:
+                raise ValueError('record extends past end of file')
+            records.append(rec)
+        return records
+
+    @property
+    def kstpkper(self):
+        '''list of unique (kstp, kper) in the file, in order'''
+        kstpkper = []
+        for rec in self.records:
+            if (rec['kstp'], rec['kper']) not in kstpkper:
+                kstpkper.append((rec['kstp'], rec['kper']))
+        return kstpkper
+
+    @property
+    def textlist(self):
+        '''list of unique budget terms in the file, in order'''
+        texts = []
+        for rec in self.records:
+            if rec['text'] not in texts:
+                texts.append(rec['text'])
+        return texts
+
+    def get_array(self, rec):
+        '''
+        record values as a full (nlay, nrow, ncol) array
+        '''
+        shape = (rec['nlay'], rec['nrow'], rec['ncol'])
+        if rec['imeth'] in (0, 1):
+            return self._read(self.realtype, rec['offset'], np.prod(shape)).reshape(shape)
+        nodes, q = self.get_flows(rec)
+        arr = np.zeros(np.prod(shape), dtype=self.realtype)
+        np.add.at(arr, nodes, q)
+        return arr.reshape(shape)
+
+    def get_flows(self, rec):
+        '''
+        record values as (0-based flat cell indices, flow) for cells in the record
+        (cells with zero flow are omitted for full-array records)
+        '''
+        ncell2d = rec['nrow'] * rec['ncol']
+        imeth = rec['imeth']
+        if imeth in (0, 1):
+            q = self._read(self.realtype, rec['offset'], ncell2d * rec['nlay'])
+            nodes = np.nonzero(q)[0]
+            return nodes, q[nodes]
+        if imeth in (2, 5):
+            dtype = [('node', '<i4'), ('q', self.realtype, (rec['nval'],))]
+            lst = self._read(dtype, rec['offset'], rec['nlist'])
+            return lst['node'] - 1, lst['q'][:, 0]
+        if imeth == 3:
+            layers = self._read('<i4', rec['offset'], ncell2d)
+            q = self._read(self.realtype, rec['offset'] + 4 * ncell2d, ncell2d)
+            return (layers - 1) * ncell2d + np.arange(ncell2d), q
+        if imeth == 4:
+            q = self._read(self.realtype, rec['offset'], ncell2d)
+            return np.arange(ncell2d), q
+        raise ValueError('unsupported budget method {}'.format(imeth))
+
+
+def _head_header(real):
+    return [('kstp', '<i4'), ('kper', '<i4'), ('pertim', real), ('totim', real), ('text', 'S16'),
+            ('ncol', '<i4'), ('nrow', '<i4'), ('ilay', '<i4')]
+
+
+class HeadFile(object):
+    '''
+    hdsfile: MODFLOW binary head (or drawdown) file
+    precision: 'single', 'double', or None to detect
+
+    records is a list of dicts with kstp, kper, pertim, totim, text, ncol, nrow, ilay (1-based layer)
+    and offset (of the layer array, in bytes); offsets is an array of layer array offsets for each
+    saved time (rows, see kstpkper and times) and layer (columns; -1 where a layer wasn't saved)
+    '''
+    def __init__(self, hdsfile, precision=None):
+        self.filename = hdsfile
+        self.data = np.memmap(hdsfile, dtype=np.uint8, mode='r')
+        self.records, self.precision = _index_file(self._index, precision, hdsfile, 'head')
+        self.realtype = _realtype(self.precision)
+        self.nrow, self.ncol = self.records[0]['nrow'], self.records[0]['ncol']
+        self.nlay = max(rec['ilay'] for rec in self.records)
+
+        times = []
+        for rec in self.records:
+            if (rec['kstp'], rec['kper'], rec['totim']) not in times:
+                times.append((rec['kstp'], rec['kper'], rec['totim']))
+        self.kstpkper = [(kstp, kper) for kstp, kper, totim in times]
+        self.times = np.array([totim for kstp, kper, totim in times])
+        self.offsets = -np.ones((len(times), self.nlay), dtype=np.int64)
+        tind = dict((t, i) for i, t in enumerate(times))
+        for rec in self.records:
+            self.offsets[tind[(rec['kstp'], rec['kper'], rec['totim'])], rec['ilay'] - 1] = rec['offset']
+
+    def _index(self, precision):
+        real = _realtype(precision)
+        header = np.dtype(_head_header(real))
+        records = []
+        pos = 0
+        size = len(self.data)
+        if size == 0:
+            raise ValueError('empty head file')
+        while pos < size:
+            if pos + header.itemsize > size:
+                raise ValueError('record extends past end of file')
+            h = np.frombuffer(self.data, dtype=header, count=1, offset=pos)[0]
+            try:
+                text = h['text'].decode('ascii').strip()
+            except UnicodeDecodeError:
+                raise ValueError('invalid head record text at byte {}'.format(pos))
+            rec = {'kstp': int(h['kstp']), 'kper': int(h['kper']), 'pertim': float(h['pertim']),
+                   'totim': float(h['totim']), 'text': text,
+                   'ncol': int(h['ncol']), 'nrow': int(h['nrow']), 'ilay': int(h['ilay'])}
+            if rec['ncol'] <= 0 or rec['nrow'] <= 0 or rec['ilay'] <= 0 or len(text) == 0 or \
+                    not all(32 <= ord(c) < 127 for c in text) or not np.isfinite(rec['totim']):
+                raise ValueError('invalid head record header at byte {}'.format(pos))
+            if len(records) > 0 and (rec['nrow'], rec['ncol']) != (records[0]['nrow'], records[0]['ncol']):
+                raise ValueError('inconsistent record dimensions at byte {}'.format(pos))
+            pos += header.itemsize
+            rec['offset'] = pos
+            pos += rec['nrow'] * rec['ncol'] * real.itemsize
+            if pos > size:
+                raise ValueError('record extends past end of file')
+            records.append(rec)
+        return records
+
+    def get_data(self, kstpkper=None, idx=None):
+        '''
+        (nlay, nrow, ncol) array of heads for a (kstp, kper), or time index idx (default is the last time)
+        layers that weren't saved are nan
+        '''
+        if idx is None:
+            idx = len(self.kstpkper) - 1 if kstpkper is None else self.kstpkper.index(tuple(kstpkper))
+        ncell2d = self.nrow * self.ncol
+        arr = np.empty((self.nlay, self.nrow, self.ncol))
+        for k, offset in enumerate(self.offsets[idx]):
+            if offset < 0:
+                arr[k] = np.nan
+                continue
+            arr[k] = np.frombuffer(self.data, dtype=self.realtype, count=ncell2d,
+                                   offset=offset).reshape(self.nrow, self.ncol)
+        return arr
+
+    def get_values(self, layers, rows, columns, idx=None):
+        '''
+        heads at the cells (0-based layers, rows and columns; arrays of the same shape) for each saved time,
+        gathered directly from the file for all cells at once
+
+        idx: optional list of time indices (default is all)
+
+        returns array of shape (ntimes,) + layers.shape; nan for layers that weren't saved
+        '''
+        layers, rows, columns = np.broadcast_arrays(np.asarray(layers), np.asarray(rows), np.asarray(columns))
+        offsets = self.offsets if idx is None else self.offsets[np.atleast_1d(idx)]
+        lay = layers.ravel()
+        cells = rows.ravel() * self.ncol + columns.ravel()
+        itemsize = self.realtype.itemsize
+        saved = offsets[:, lay] >= 0
+        values = np.empty(saved.shape)
+        if np.all(offsets[offsets >= 0] % itemsize == 0):
+            # all records aligned (always for single precision): index a float view of the whole file
+            floats = self.data[:len(self.data) // itemsize * itemsize].view(self.realtype)
+            pos = offsets[:, lay] // itemsize + cells
+            values[saved] = floats[pos[saved]]
+        else:
+            # read each layer record that has cells (as an unaligned view of the file)
+            ncell2d = self.nrow * self.ncol
+            inlayer = [(k, np.where(lay == k)[0]) for k in np.unique(lay)]
+            for t, recoffsets in enumerate(offsets):
+                for k, n in inlayer:
+                    if recoffsets[k] >= 0:
+                        record = np.frombuffer(self.data, dtype=self.realtype, count=ncell2d, offset=recoffsets[k])
+                        values[t, n] = record[cells[n]]
+        values[~saved] = np.nan
+        return values.reshape((len(offsets),) + layers.shape)
+
+
+def interzone_flows(q, zones, offset, nzones):
+    '''
+    flows between zones across one set of cell faces
+
+    q: (nlay, nrow, ncol) face flow array (e.g. FLOW RIGHT FACE; positive toward the neighboring cell)
+    zones: (nlay, nrow, ncol) integer zone array
+    offset: (layer, row, column) offset of the neighboring cell (see face_terms)
+
+    returns (nzones, nzones) array of flow from zone [i] to zone [j]
+    '''
+    nl, nr, nc = zones.shape
+    dl, dr, dc = offset
+    za = zones[:nl - dl, :nr - dr, :nc - dc]
+    zb = zones[dl:, dr:, dc:]
+    q = q[:nl - dl, :nr - dr, :nc - dc]
+    diff = (za != zb) & (q != 0)
+    a, b, q = za[diff], zb[diff], q[diff]
+    pos = q > 0
+    flows = np.bincount(a[pos] * nzones + b[pos], weights=q[pos], minlength=nzones**2) + \
+        np.bincount(b[~pos] * nzones + a[~pos], weights=-q[~pos], minlength=nzones**2)
+    return flows.reshape(nzones, nzones)
+
+
+def zone_budget(cbb, zones, kstpkper=None):
+    '''
+    zone budgets for all zones and time steps, in one read of the budget file
+
+    cbb: CellBudgetFile instance, or budget filename
+    zones: (nlay, nrow, ncol) integer zone array (zone numbers >= 0)
+    kstpkper: optional list of (kstp, kper) to compute; default is all
+
+    returns dict keyed by (kstp, kper) of dicts with
+    in, out: dicts of {budget term: array of flow for each zone number (0 to max zone)}
+        (positive values; flows into and out of the groundwater system in the zone)
+    interzone: (nzones, nzones) array of flow from zone [i] to zone [j]
+    '''
+    if not isinstance(cbb, CellBudgetFile):
+        cbb = CellBudgetFile(cbb)
+    zones = np.asarray(zones, dtype=int)
+    nzones = zones.max() + 1
+    zflat = zones.ravel()
+
+    budgets = {}
+    for rec in cbb.records:
+        key = (rec['kstp'], rec['kper'])
+        if kstpkper is not None and key not in kstpkper:
+            continue
+        if (rec['nlay'], rec['nrow'], rec['ncol']) != zones.shape:
+            raise ValueError('zone array shape {} does not match budget file {}'.format(
+                zones.shape, (rec['nlay'], rec['nrow'], rec['ncol'])))
+        if key not in budgets:
+            budgets[key] = {'in': {}, 'out': {}, 'interzone': np.zeros((nzones, nzones))}
+        b = budgets[key]
+        text = rec['text']
+        if text in face_terms:
+            b['interzone'] += interzone_flows(cbb.get_array(rec), zones, face_terms[text], nzones)
+            continue
+        nodes, q = cbb.get_flows(rec)
+        z = zflat[nodes]
+        qin = np.bincount(z, weights=np.where(q > 0, q, 0), minlength=nzones)
+        qout = np.bincount(z, weights=np.where(q < 0, -q, 0), minlength=nzones)
+        b['in'][text] = b['in'].get(text, 0) + qin
+        b['out'][text] = b['out'].get(text, 0) + qout
+    return budgets
+
+
+def budget_totals(budget):
+    '''
+    total in, total out (including flows from/to other zones), and percent discrepancy for each zone,
+    for one time step of zone_budget results
+    '''
+    interzone = budget['interzone'].copy()
+    np.fill_diagonal(interzone, 0)
+    total_in = sum(budget['in'].values()) + interzone.sum(axis=0)
+    total_out = sum(budget['out'].values()) + interzone.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        discrepancy = 100. * (total_in - total_out) / ((total_in + total_out) / 2.)
+    return total_in, total_out, discrepancy
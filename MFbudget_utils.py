@@ -0,0 +1,160 @@
+'''
+Parsers for the volumetric budget tables in MODFLOW listing (.lst) files and ZoneBudget (.zout) output
+
+The file is memory-mapped, and the budget blocks are found with compiled byte regular expressions,
+so that only the budget tables are read from large (multi-GB) transient listing files.
+Results are returned as pandas DataFrames with one row per time step (and zone, for .zout files),
+and a column for each budget term and direction (e.g. CONSTANT_HEAD_IN, CONSTANT_HEAD_OUT),
+plus the totals and percent discrepancy.
+
+usage:
+import MFbudget_utils
+df = MFbudget_utils.read_lst_budget('model.lst')
+MFbudget_utils.export(df, 'model_budget.csv') # or .parquet (requires pyarrow or fastparquet)
+'''
+import re
+import mmap
+import numpy as np
+import pandas as pd
+import io_utils
+
+_lst_header = re.compile(br'VOLUMETRIC BUDGET FOR ENTIRE MODEL AT END OF TIME STEP\s*(\d+)\s*,\s*STRESS PERIOD\s*(\d+)')
+_lst_end = re.compile(br'PERCENT DISCREPANCY\s*=\s*(\S+)\s+PERCENT DISCREPANCY\s*=\s*(\S+)')
+
+_zout_header = re.compile(br'Flow Budget for Zone\s*(\d+)\s*at Time Step\s*(\d+)\s*of Stress Period\s*(\d+)')
+_zout_end = re.compile(br'Percent Discrepancy\s*=[^\n]*')
+
+# terms that are not listed separately for IN and OUT
+_totals = {'TOTAL IN': 'TOTAL_IN', 'TOTAL OUT': 'TOTAL_OUT', 'IN - OUT': 'IN-OUT',
+           'PERCENT DISCREPANCY': 'PERCENT_DISCREPANCY'}
+
+
+def _value(value):
+    # values that overflow the listing format are written as asterisks (nan)
+    return io_utils.to_float([value])[0]
+
+
+def _column(term, direction):
+    term = ' '.join(term.decode('ascii', 'replace').upper().split())
+    if term in _totals:
+        return _totals[term]
+    return '{}_{}'.format(term.replace(' ', '_'), direction)
+
+
+def _blocks(filename, header, end):
+    '''
+    generator of (header match, end match, budget block bytes) for each budget table in filename
+    '''
+    with open(filename, 'rb') as infile:
+        try:
+            data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # empty file
+            return
+        try:
+            pos = 0
+            while True:
+                h = header.search(data, pos)
+                if h is None:
+                    break
+                e = end.search(data, h.end())
+                if e is None:
+                    break
+                nexth = header.search(data, h.end(), e.start())
+                if nexth is not None: # incomplete table (e.g. model stopped while writing)
+                    pos = nexth.start()
+                    continue
+                yield h, e, data[h.end():e.end()]
+                pos = e.end()
+        finally:
+            data.close()
+
+
+def _term_lines(block):
+    '''
+    (fields, direction) for each term line in a block, where fields are the line split at '=';
+    lines after OUT: are OUT
+    (the lines are split directly; a regular expression for the term lines is several times slower)
+    '''
+    direction = 'IN'
+    for line in block.split(b'\n'):
+        if b'=' not in line:
+            if line.lstrip().startswith(b'OUT:'):
+                direction = 'OUT'
+            continue
+        yield line.split(b'='), direction
+
+
+def _table(rows, index_columns):
+    columns = list(index_columns)
+    for row in rows:
+        for c in row:
+            if c not in columns:
+                columns.append(c)
+    return pd.DataFrame(rows, columns=columns)
+
+
+def read_lst_budget(lstfile, cumulative=False):
+    '''
+    volumetric budgets from a MODFLOW listing file
+
+    cumulative: True for the cumulative volumes; default is the rates for each time step
+
+    returns DataFrame with kstp, kper, and IN and OUT columns for each term, TOTAL_IN, TOTAL_OUT,
+    IN-OUT and PERCENT_DISCREPANCY (one row per budget table in the file)
+    '''
+    rows = []
+    for h, e, block in _blocks(lstfile, _lst_header, _lst_end):
+        row = {'kstp': int(h.group(1)), 'kper': int(h.group(2))}
+        for fields, direction in _term_lines(block):
+            if len(fields) != 3: # cumulative volume and rate for a term, side by side
+                continue
+            volume = fields[1].split()
+            if len(volume) < 2:
+                continue
+            if cumulative:
+                term, value = fields[0], volume[0]
+            else:
+                term, value = b' '.join(volume[1:]), fields[2]
+            row[_column(term, direction)] = _value(value)
+        rows.append(row)
+    return _table(rows, ['kstp', 'kper'])
+
+
+def read_zout_budget(zoutfile):
+    '''
+    zone budgets from ZoneBudget (.zout) output
+
+    returns DataFrame with kstp, kper, zone, and IN and OUT columns for each term (including
+    flows from/to other zones, e.g. ZONE_2_TO_1_IN), TOTAL_IN, TOTAL_OUT, IN-OUT and PERCENT_DISCREPANCY
+    '''
+    rows = []
+    for h, e, block in _blocks(zoutfile, _zout_header, _zout_end):
+        row = {'kstp': int(h.group(2)), 'kper': int(h.group(3)), 'zone': int(h.group(1))}
+        for fields, direction in _term_lines(block):
+            if len(fields) == 2:
+                row[_column(fields[0], direction)] = _value(fields[1])
+        rows.append(row)
+    return _table(rows, ['kstp', 'kper', 'zone'])
+
+
+def read_lst_discrepancy(lstfile):
+    '''
+    percent discrepancy for each budget table in a MODFLOW listing file, without parsing the budget terms
+
+    returns DataFrame with kstp, kper, cumulative and rate
+    '''
+    rows = []
+    for h, e, block in _blocks(lstfile, _lst_header, _lst_end):
+        rows.append({'kstp': int(h.group(1)), 'kper': int(h.group(2)),
+                     'cumulative': _value(e.group(1)), 'rate': _value(e.group(2))})
+    return _table(rows, ['kstp', 'kper', 'cumulative', 'rate'])
+
+
+def export(df, outfile):
+    '''
+    write a budget table to csv, or to parquet if outfile ends with .parquet
+    '''
+    if outfile.lower().endswith('.parquet'):
+        df.to_parquet(outfile, index=False)
+    else:
+        df.to_csv(outfile, index=False)
@@ -0,0 +1,312 @@
+'''
+GIS operations on a regular (optionally rotated) MODFLOW grid, without per-cell polygon shapefiles or arcpy
+
+Cell centers and corners come from grid_utils (ModelGrid.cell_centers and cell_corners, with the
+grid located by its lower left corner and rotated about it, as in grid_utils.locate_points).
+Polygons (e.g. NHDPlus catchments) are assigned to cells by the polygon containing each cell center:
+the grid is processed in tiles of tilesize x tilesize cells, and for each tile only the polygons with
+bounding boxes overlapping the tile (from an array of polygon bounds) are tested, with vectorized
+point-in-polygon tests (matplotlib.path). Tiles can be processed in parallel.
+
+Zones of an integer array on the grid (e.g. the UZF IRUNBND array) are dissolved into one polygon
+per zone value by tracing the zone boundaries on the array (dissolve_array), instead of unioning
+a polygon for each cell.
+
+Geometries can be shapely geometries (e.g. from GISio.shp2df(geometry=True)), or GeoJSON-like
+mappings (e.g. fiona records) of Polygons or MultiPolygons. Shapefiles in other projections
+(e.g. NHDPlus in geographic NAD83) can be reprojected to the model projection with reproject (requires pyproj).
+
+usage:
+import grid_utils
+import MFgrid_utils
+grid = grid_utils.ModelGrid.from_DIS('model.dis', xll=xll, yll=yll, rotation=rotation)
+x, y = grid.cell_centers()
+featureid = MFgrid_utils.rasterize_polygons(catchments.geometry, catchments.FEATUREID, x, y)
+xc, yc = grid.cell_corners()
+values, polygons = MFgrid_utils.dissolve_array(IRUNBND, xc, yc)
+'''
+import os
+import multiprocessing
+import numpy as np
+from matplotlib.path import Path
+
+
+def reproject(geometries, prjfile, dest_prjfile):
+    '''
+    shapely geometries reprojected from the projection in prjfile to the projection in dest_prjfile
+    (e.g. from the .prj files of two shapefiles); geometries are returned unchanged if the projections are the same
+
+    reprojection requires pyproj; without it, geometries in different projections raise an ImportError
+    '''
+    projections = []
+    for f in (prjfile, dest_prjfile):
+        if not os.path.exists(f):
+            raise IOError('projection file {} not found; the projection of the shapefile is needed'.format(f))
+        with open(f) as infile:
+            projections.append(infile.read().strip())
+    if projections[0] == projections[1]:
+        return list(geometries)
+    try:
+        import pyproj
+        from shapely.ops import transform
+    except ImportError:
+        raise ImportError('{} and {} are different projections; install pyproj to reproject, '
+                          'or reproject the shapefile first'.format(prjfile, dest_prjfile))
+    source, dest = pyproj.CRS.from_wkt(projections[0]), pyproj.CRS.from_wkt(projections[1])
+    if source == dest:
+        return list(geometries)
+    transformer = pyproj.Transformer.from_crs(source, dest, always_xy=True)
+    return [transform(transformer.transform, g) for g in geometries]
+
+
+def polygon_rings(geometry):
+    '''
+    list of (exterior, [interiors]) coordinate arrays for the parts of a Polygon or MultiPolygon
+    '''
+    geometry = getattr(geometry, '__geo_interface__', geometry)
+    if geometry['type'] == 'Polygon':
+        parts = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        parts = geometry['coordinates']
+    else:
+        raise ValueError('{} geometries are not supported'.format(geometry['type']))
+    return [(np.array(part[0], dtype=float)[:, :2], [np.array(ring, dtype=float)[:, :2] for ring in part[1:]])
+            for part in parts]
+
+
+def _contains(rings, points):
+    # boolean array of the points inside the polygon (inside an exterior ring, and not inside its holes)
+    inside = np.zeros(len(points), dtype=bool)
+    for exterior, interiors in rings:
+        inpart = Path(exterior).contains_points(points)
+        for ring in interiors:
+            inpart[inpart] = ~Path(ring).contains_points(points[inpart])
+        inside |= inpart
+    return inside
+
+
+# polygons for worker processes (set by _init_worker)
+_polygons = {}
+
+
+def _init_worker(rings, bounds, values):
+    _polygons['rings'], _polygons['bounds'], _polygons['values'] = rings, bounds, values
+
+
+def _rasterize_tile(args):
+    '''
+    values of the polygons containing the cell centers of one tile; cells not in any polygon are nan
+    (where polygons overlap, the first polygon is used)
+    '''
+    r0, c0, x, y = args
+    rings, bounds, values = _polygons['rings'], _polygons['bounds'], _polygons['values']
+    result = np.empty(x.shape)
+    result.fill(np.nan)
+    points = np.column_stack([x.ravel(), y.ravel()])
+    unassigned = np.ones(len(points), dtype=bool)
+    # polygons with bounding boxes overlapping the tile
+    candidates = np.where((bounds[:, 0] <= x.max()) & (bounds[:, 2] >= x.min()) &
+                          (bounds[:, 1] <= y.max()) & (bounds[:, 3] >= y.min()))[0]
+    for n in candidates:
+        xmin, ymin, xmax, ymax = bounds[n]
+        inbox = np.where(unassigned & (points[:, 0] >= xmin) & (points[:, 0] <= xmax) &
+                         (points[:, 1] >= ymin) & (points[:, 1] <= ymax))[0]
+        if len(inbox) == 0:
+            continue
+        inside = inbox[_contains(rings[n], points[inbox])]
+        result.flat[inside] = values[n]
+        unassigned[inside] = False
+        if not unassigned.any():
+            break
+    return r0, c0, result
+
+
+def rasterize_polygons(geometries, values, x, y, fill=0, tilesize=256, processes=1):
+    '''
+    array (same shape as x and y) of the value of the polygon containing each cell center
+
+    geometries: sequence of polygon geometries
+    values: value for each polygon (e.g. catchment FEATUREID)
+    x, y: cell center coordinates (from grid_utils.cell_centers)
+    fill: value for cells that aren't in any polygon
+    tilesize: number of rows and columns in each tile
+    processes: number of worker processes for the tiles (1 processes them in this process);
+        scripts using more than one process need an if __name__ == '__main__' guard (Windows)
+    '''
+    rings = [polygon_rings(g) for g in geometries]
+    bounds = np.array([[min(e[:, 0].min() for e, i in r), min(e[:, 1].min() for e, i in r),
+                        max(e[:, 0].max() for e, i in r), max(e[:, 1].max() for e, i in r)] for r in rings]).reshape(-1, 4)
+    values = np.asarray(values, dtype=float)
+    nrow, ncol = x.shape
+    tiles = [(r0, c0, x[r0:r0 + tilesize, c0:c0 + tilesize], y[r0:r0 + tilesize, c0:c0 + tilesize])
+             for r0 in range(0, nrow, tilesize) for c0 in range(0, ncol, tilesize)]
+
+    result = np.empty((nrow, ncol))
+    if processes > 1 and len(tiles) > 1:
+        pool = multiprocessing.Pool(min(processes, len(tiles)), initializer=_init_worker,
+                                    initargs=(rings, bounds, values))
+        try:
+            for r0, c0, tile in pool.imap_unordered(_rasterize_tile, tiles):
+                result[r0:r0 + tile.shape[0], c0:c0 + tile.shape[1]] = tile
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_worker(rings, bounds, values)
+        for args in tiles:
+            r0, c0, tile = _rasterize_tile(args)
+            result[r0:r0 + tile.shape[0], c0:c0 + tile.shape[1]] = tile
+    result[np.isnan(result)] = fill
+    return result
+
+
+# edge directions (row, column) around cells with the zone on the left: down the left side of a cell,
+# along the bottom, up the right side, and along the top (counterclockwise); a left turn is the next code
+_directions = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+
+
+def _boundary_edges(zones):
+    '''
+    directed unit edges between cells of different zones (and the edge of the grid), for all cells at once
+
+    returns arrays of zone, starting corner (row, column), and direction code of each edge
+    '''
+    padded = np.pad(zones, 1, mode='constant', constant_values=-1)
+    center = padded[1:-1, 1:-1]
+    neighbors = [padded[1:-1, :-2], padded[2:, 1:-1], padded[1:-1, 2:], padded[:-2, 1:-1]]
+    corner_offsets = [(0, 0), (1, 0), (1, 1), (0, 1)] # starting corner of each edge, relative to the cell
+    edges = []
+    for d, (neighbor, (dr, dc)) in enumerate(zip(neighbors, corner_offsets)):
+        r, c = np.where(center != neighbor)
+        edges.append((center[r, c], r + dr, c + dc, np.ones(len(r), dtype=int) * d))
+    return [np.concatenate(a) for a in zip(*edges)]
+
+
+def _trace_rings(zone, sr, sc, direction, ncol):
+    '''
+    chain boundary edges into closed rings (one zone at a time), keeping the zone on the left;
+    where cells of a zone touch only at a corner, the rings are kept separate (turning left)
+
+    returns list of (zone, list of ring corners (row, column))
+    '''
+    key = lambda z, r, c: (z, r * (ncol + 1) + c)
+    outgoing = {}
+    for n, k in enumerate(zip(zone.tolist(), (sr * (ncol + 1) + sc).tolist())):
+        outgoing.setdefault(k, []).append(n)
+
+    rings = []
+    for first in range(len(zone)):
+        if direction[first] < 0:
+            continue # already in a ring
+        z = zone[first]
+        r, c, d = sr[first], sc[first], direction[first]
+        corners = [(r, c)]
+        n = first
+        while True:
+            direction[n] = -1 - direction[n] # mark as used (keeping the direction)
+            r, c = r + _directions[d][0], c + _directions[d][1]
+            candidates = outgoing[key(z, r, c)]
+            # next edge: left turn, straight, or right turn (the first edge closes the ring)
+            choices = dict((-1 - direction[e] if e == first else direction[e], e) for e in candidates
+                           if direction[e] >= 0 or e == first)
+            for turn in ((d + 1) % 4, d, (d + 3) % 4):
+                if turn in choices:
+                    break
+            n = choices[turn]
+            if n == first:
+                break
+            if turn != d:
+                corners.append((r, c))
+            d = turn
+        rings += [(z, ring) for ring in _split_ring(corners)]
+    return rings
+
+
+def _split_ring(corners):
+    '''
+    split a ring that passes through a corner more than once (e.g. around two holes that touch only
+    at a corner) into rings that each pass through it once
+    '''
+    rings = []
+    path = []
+    position = {}
+    for corner in corners:
+        if corner in position:
+            n = position[corner]
+            rings.append(path[n:])
+            for other in path[n + 1:]:
+                del position[other]
+            path = path[:n + 1]
+        else:
+            position[corner] = len(path)
+            path.append(corner)
+    return rings + [path]
+
+
+def _closed_ring(x, y):
+    ring = list(zip(x.tolist(), y.tolist()))
+    return ring + ring[:1]
+
+
+def dissolve_array(array, x=None, y=None, ignore=None):
+    '''
+    one polygon for each value in a 2D integer array on a regular grid, from the boundaries between values
+
+    array: (nrow, ncol) array of zone values (e.g. IRUNBND)
+    x, y: (nrow+1, ncol+1) cell corner coordinates (from grid_utils.cell_corners); default is column and -row
+    ignore: optional sequence of values not to make polygons for (e.g. [0])
+
+    returns list of values, and list of GeoJSON-like Polygon or MultiPolygon mappings (exteriors counterclockwise);
+    use shapely.geometry.shape to convert them to shapely geometries
+    '''
+    array = np.asarray(array)
+    nrow, ncol = array.shape
+    values, zones = np.unique(array, return_inverse=True)
+    zones = zones.reshape(nrow, ncol)
+    if x is None:
+        y, x = np.indices((nrow + 1, ncol + 1))
+        y = -y
+
+    zone, sr, sc, direction = _boundary_edges(zones)
+    exteriors, holes = {}, {}
+    for z, corners in _trace_rings(zone, sr, sc, direction, ncol):
+        rows, columns = np.array(corners).T
+        # signed area in column, -row coordinates (positive for exteriors)
+        area = 0.5 * np.sum(columns * -np.roll(rows, -1) - np.roll(columns, -1) * -rows)
+        if area > 0:
+            exteriors.setdefault(z, []).append((rows, columns, area))
+        else:
+            # cell of the zone on the left of the first edge of the hole
+            dr, dc = np.sign(rows[1] - rows[0]), np.sign(columns[1] - columns[0])
+            cell = (rows[0] + 0.5 * (dr - dc), columns[0] + 0.5 * (dc + dr))
+            holes.setdefault(z, []).append((rows, columns, cell))
+
+    result_values, polygons = [], []
+    for z in sorted(exteriors):
+        if ignore is not None and values[z] in ignore:
+            continue
+        parts = [[ring] for ring in exteriors[z]]
+        if len(parts) > 1 and z in holes:
+            bounds = np.array([[rows.min(), rows.max(), columns.min(), columns.max()] for rows, columns, area in exteriors[z]])
+            paths = {}
+        for hrows, hcolumns, (r, c) in holes.get(z, []):
+            if len(parts) == 1:
+                parts[0].append((hrows, hcolumns, None))
+                continue
+            # the hole belongs to the smallest exterior containing a cell of the zone next to it
+            containing = []
+            for n in np.where((bounds[:, 0] < r) & (bounds[:, 1] > r) & (bounds[:, 2] < c) & (bounds[:, 3] > c))[0]:
+                rows, columns, area = exteriors[z][n]
+                if n not in paths:
+                    paths[n] = Path(np.column_stack([columns, -rows]))
+                if paths[n].contains_point((c, -r)):
+                    containing.append((area, n))
+            parts[min(containing)[1]].append((hrows, hcolumns, None))
+        coordinates = [[_closed_ring(x[rows, columns], y[rows, columns]) for rows, columns, info in part]
+                       for part in parts]
+        result_values.append(values[z])
+        if len(coordinates) == 1:
+            polygons.append({'type': 'Polygon', 'coordinates': coordinates[0]})
+        else:
+            polygons.append({'type': 'MultiPolygon', 'coordinates': coordinates})
+    return result_values, polygons
@@ -3,109 +3,165 @@ __author__ = 'aleaf'
 Route MODFLOW UZF Package groundwater discharge to landsurface to SFR segments, using catchment info from NHDplus v2
 inputs:
 NHDPlus v2 catchment files (e.g. NHDPlusV21_GL_04_NHDPlusCatchments_05.7z; available from http://www.horizon-systems.com/NHDPlus/NHDPlusV2_04.php)
-shapefiles of model grid cells, model domain, and SFR cells (all in same projection)
+shapefiles of model domain and SFR cells (with row and column attributes), and the model DIS file and grid location
+(lower left corner and rotation, in the model projection; the catchments are reprojected to the projection of the SFR shapefile if their .prj differs,
+which requires pyproj; with use_arcpy=True, arcpy reprojects them, and a shapefile of model grid cells is used instead)
+
+Each grid cell is assigned to the catchment containing its center (MFgrid_utils.rasterize_polygons, in tiles),
+so no ArcGIS license or shapefile of model grid cells is needed. The shapefile of areas draining to each segment
+is traced directly from the IRUNBND array (MFgrid_utils.dissolve_array).
 
 requirements:
-arcpy
-GISio and GISops, from aleaf/GIS_utils on github
-(these require the fiona, shapely, and pandas packages)
+GISio, from aleaf/GIS_utils on github
+(this requires the fiona, shapely, and pandas packages)
+matplotlib
+pyproj (only if the catchments aren't in the model projection)
+arcpy (only with use_arcpy=True)
 '''
 import numpy as np
-import arcpy
 import os
 import sys
 GIS_utils_path = 'D:/PFJData2/Programs/GIS_utils'
 if GIS_utils_path not in sys.path:
     sys.path.append(GIS_utils_path)
 import GISio
-import GISops
+from shapely.geometry import shape
 
 import pandas as pd
+import grid_utils
+import MFarray_utils
+import MFgrid_utils
 
 # NHDPlus v2 catchment files (list)
 catchments = ['D:/ATLData/BadRiver/BCs/NHDPlusGL/NHDPlus07/NHDPlusV21_MS_07_NHDPlusCatchment_01/NHDPlusMS/NHDPlus07/NHDPlusCatchment/Catchment.shp',
               'D:/ATLData/BadRiver/BCs/NHDPlusGL/NHDPlus04/NHDPlusV21_GL_04_NHDPlusCatchments_05/NHDPlusGL/NHDPlus04/NHDPlusCatchment/Catchment.shp']
 # input shapefile (should all be in same projection!)
 MFdomain = 'D:/ATLData/BadRiver/BCs/Arcfiles/BadRiver_MFdomain_WISP.shp'
-MFgrid = 'D:/ATLData/BadRiver/BCs/Arcfiles/BadRiver_gridcells_WISP.shp'
 SFR_shapefile = 'D:/ATLData/Documents/GitHub/SFR/BR_SFR_with_WI_hydro.shp'
 
+# model grid
+DISfile = 'D:/ATLData/Documents/GitHub/SFR/BadRiver.dis'
+xll, yll = None, None # lower left corner of the model grid, in the projection of the SFR shapefile (required)
+rotation = None # counterclockwise rotation of the grid about the lower left corner (degrees; required, 0. if not rotated)
+tilesize = 256 # rows and columns of grid cells in each tile of catchment assignment
+processes = 1 # worker processes for the tiles (more than 1 requires Linux, or an if __name__ == '__main__' guard)
+
+# ArcGIS option (reprojects and clips the catchments, and spatially joins them to a shapefile of model grid cells)
+use_arcpy = False
+MFgrid = 'D:/ATLData/BadRiver/BCs/Arcfiles/BadRiver_gridcells_WISP.shp'
+
 # output
 out_IRUNBND = 'BadRiver_IRUNBND.dat'
 out_IRUNBND_shp = 'BadRiver_IRUNBND.shp'
-
-# initialize the arcpy environment
-arcpy.env.workspace = os.getcwd()
-arcpy.env.overwriteOutput = True
-arcpy.env.qualifiedFieldNames = False
-arcpy.CheckOutExtension("spatial") # Check spatial analyst license
-
-# preprocessing
-
-print 'merging NHDPlus catchemnt files:'
-for f in catchments:
-    print f
-if len(catchments) > 1:
-    arcpy.Merge_management(catchments, os.path.join(os.getcwd(), 'temp.shp'))
+out_reach_counts = 'BadRiver_catchment_reaches.csv' # number of SFR reaches of each segment in each catchment
+
+if xll is None or yll is None or rotation is None:
+    raise ValueError('set xll, yll and rotation to the location of the model grid (in the projection of {})'.format(SFR_shapefile))
+grid = grid_utils.ModelGrid.from_DIS(DISfile, xll=xll, yll=yll, rotation=rotation)
+nrows, ncols = grid.nrow, grid.ncol
+
+if use_arcpy:
+    import arcpy
+
+    # initialize the arcpy environment
+    arcpy.env.workspace = os.getcwd()
+    arcpy.env.overwriteOutput = True
+    arcpy.env.qualifiedFieldNames = False
+    arcpy.CheckOutExtension("spatial") # Check spatial analyst license
+
+    # preprocessing
+
+    print 'merging NHDPlus catchemnt files:'
+    for f in catchments:
+        print f
+    if len(catchments) > 1:
+        arcpy.Merge_management(catchments, os.path.join(os.getcwd(), 'temp.shp'))
+    else:
+        arcpy.CopyFeatures_management(catchments[0], os.path.join(os.getcwd(), 'temp.shp'))
+
+    print '\nreprojecting to {}.prj'.format(SFR_shapefile[:-4])
+    arcpy.Project_management(os.path.join(os.getcwd(), 'temp.shp'), os.path.join(os.getcwd(), 'temp2.shp'),
+                             SFR_shapefile[:-4] + '.prj')
+
+    print 'clipping to {}'.format(MFdomain)
+    arcpy.Clip_analysis(os.path.join(os.getcwd(), 'temp2.shp'), MFdomain, os.path.join(os.getcwd(), 'catchments.shp'))
+
+    print 'performing spatial join of catchments to SFR cells...'
+    # intersect is way faster than spatial join
+    arcpy.SpatialJoin_analysis(SFR_shapefile,
+                               os.path.join(os.getcwd(), 'catchments.shp'),
+                               os.path.join(os.getcwd(), 'catchments_joined.shp'))
+    print 'and to model grid (this may take awhile)...'
+    arcpy.SpatialJoin_analysis(MFgrid,
+                               os.path.join(os.getcwd(), 'catchments.shp'),
+                               os.path.join(os.getcwd(), 'MFgrid_catchments.shp'))
+
+    print 'reading {} into pandas dataframe...'.format(os.path.join(os.getcwd(), 'catchments_joined.shp'))
+    SFRcatchments = GISio.shp2df(os.path.join(os.getcwd(), 'catchments_joined.shp'))
+    MFgrid_joined = GISio.shp2df(os.path.join(os.getcwd(), 'MFgrid_catchments.shp'))
+    MFgrid_joined.index = MFgrid_joined.node
+    featureid = MFgrid_joined.FEATUREID.sort_index().values.reshape(nrows, ncols)
+    prj = os.path.join(os.getcwd(), 'MFgrid_catchments.shp')[:-4] + '.prj'
 else:
-    arcpy.CopyFeatures_management(catchments[0], os.path.join(os.getcwd(), 'temp.shp'))
-
-print '\nreprojecting to {}.prj'.format(SFR_shapefile[:-4])
-arcpy.Project_management(os.path.join(os.getcwd(), 'temp.shp'), os.path.join(os.getcwd(), 'temp2.shp'),
-                         SFR_shapefile[:-4] + '.prj')
-
-print 'clipping to {}'.format(MFdomain)
-arcpy.Clip_analysis(os.path.join(os.getcwd(), 'temp2.shp'), MFdomain, os.path.join(os.getcwd(), 'catchments.shp'))
-
-print 'performing spatial join of catchments to SFR cells...'
-# intersect is way faster than spatial join
-arcpy.SpatialJoin_analysis(SFR_shapefile,
-                           os.path.join(os.getcwd(), 'catchments.shp'),
-                           os.path.join(os.getcwd(), 'catchments_joined.shp'))
-print 'and to model grid (this may take awhile)...'
-arcpy.SpatialJoin_analysis(MFgrid,
-                           os.path.join(os.getcwd(), 'catchments.shp'),
-                           os.path.join(os.getcwd(), 'MFgrid_catchments.shp'))
+    # catchments and model domain in the model projection (that of the SFR shapefile)
+    prj = SFR_shapefile[:-4] + '.prj'
+    print 'reading NHDPlus catchment files:'
+    cmts = []
+    for f in catchments:
+        print f
+        df = GISio.shp2df(f, geometry=True)
+        df['geometry'] = MFgrid_utils.reproject(df.geometry, f[:-4] + '.prj', prj)
+        cmts.append(df)
+    cmts = pd.concat(cmts, ignore_index=True)
+
+    print 'assigning catchments to model grid cells from {}...'.format(DISfile)
+    x, y = grid.cell_centers()
+    featureid = MFgrid_utils.rasterize_polygons(cmts.geometry, cmts.FEATUREID, x, y,
+                                                tilesize=tilesize, processes=processes).astype(int)
+    # cells outside of the model domain aren't in any catchment
+    domain = GISio.shp2df(MFdomain, geometry=True)
+    domain['geometry'] = MFgrid_utils.reproject(domain.geometry, MFdomain[:-4] + '.prj', prj)
+    indomain = MFgrid_utils.rasterize_polygons(domain.geometry, np.ones(len(domain)), x, y,
+                                               tilesize=tilesize, processes=processes)
+    featureid[indomain == 0] = 0
+    if not (featureid != 0).any():
+        raise ValueError('no model cells are in a catchment within the model domain; check xll, yll and rotation, '
+                         'and the projections of {} and {}'.format(catchments, MFdomain))
+
+    # catchment of each SFR reach, from the catchment of its cell
+    SFRcatchments = GISio.shp2df(SFR_shapefile)
+    SFRcatchments['FEATUREID'] = featureid[SFRcatchments.row.values - 1, SFRcatchments.column.values - 1]
+    SFRcatchments = SFRcatchments[SFRcatchments.FEATUREID != 0]
 
 # now figure out which SFR segment each catchment should drain to
-print 'reading {} into pandas dataframe...'.format(os.path.join(os.getcwd(), 'catchments_joined.shp'))
-SFRcatchments = GISio.shp2df(os.path.join(os.getcwd(), 'catchments_joined.shp'))
-
-print 'assigning an SFR segment to each catchment... (this may take awhile)'
-intersected_catchments = list(np.unique(SFRcatchments.FEATUREID))
-segments_dict = {}
-for cmt in intersected_catchments:
-    try:
-        segment = SFRcatchments[SFRcatchments.FEATUREID == cmt].segment.mode()[0]
-    except: # pandas crashes if mode is called on df of length 1
-        segment = SFRcatchments[SFRcatchments.FEATUREID == cmt].segment[0]
-    segments_dict[cmt] = segment
-    # can also use values_count() to get a frequency table for segments (reaches) in each catchment
-
-print 'building UZF package IRUNBND array from {}'.format(MFgrid)
-MFgrid_joined = GISio.shp2df(os.path.join(os.getcwd(), 'MFgrid_catchments.shp'), geometry=True)
-MFgrid_joined.index = MFgrid_joined.node
-nrows, ncols = np.max(MFgrid_joined.row), np.max(MFgrid_joined.column)
-
-# make new column of SFR segment for each grid cell
-MFgrid_joined['segment'] = MFgrid_joined.FEATUREID.apply(segments_dict.get).fillna(0)
+print 'assigning an SFR segment to each catchment...'
+# number of reaches of each segment in each catchment (one grouped pass over all reaches);
+# each catchment drains to the segment with the most reaches, with ties going to the lowest segment number
+reach_counts = SFRcatchments.groupby(['FEATUREID', 'segment']).size().reset_index()
+reach_counts.columns = ['FEATUREID', 'segment', 'reaches']
+reach_counts = reach_counts.sort_values(['FEATUREID', 'reaches', 'segment'], ascending=[True, False, True])
+reach_counts['dominant'] = ~reach_counts.FEATUREID.duplicated()
+segments_dict = dict(zip(reach_counts.FEATUREID[reach_counts.dominant], reach_counts.segment[reach_counts.dominant]))
+
+print 'writing {}'.format(out_reach_counts)
+reach_counts.to_csv(out_reach_counts, index=False)
+
+print 'building UZF package IRUNBND array...'
+# SFR segment for each grid cell
+IRUNBND = pd.Series(featureid.ravel()).map(segments_dict).fillna(0).values.astype(int).reshape(nrows, ncols)
+if not (IRUNBND != 0).any():
+    raise ValueError('no SFR segments were assigned to catchments; check that the SFR reaches are within the catchments')
 
 print 'writing {}'.format(out_IRUNBND)
-# should add code to allow for a dataframe that only includes a subset of model cells
-# (could build a DF of zeros for each cellnum, and then merge with DF containing UZF cells, replacing the zeros for those cells
-IRUNBND = np.reshape(MFgrid_joined['segment'].sort_index().values, (nrows, ncols))
-np.savetxt(out_IRUNBND, IRUNBND, fmt='%i', delimiter=' ')
+MFarray_utils.write_layers(out_IRUNBND, IRUNBND, fmt='%i', delimiter=' ')
 
 print 'writing {}'.format(out_IRUNBND_shp)
-#df, shpname, geo_column, prj
-GISio.df2shp(MFgrid_joined,
-             os.path.join(os.getcwd(), 'MFgrid_segments.shp'),
-             'geometry',
-             os.path.join(os.getcwd(), 'MFgrid_catchments.shp')[:-4]+'.prj')
-
-MFgrid_joined_dissolved = GISops.dissolve_df(MFgrid_joined, 'segment')
+# one polygon for each segment, traced from the boundaries between segments in the IRUNBND array
+corners_x, corners_y = grid.cell_corners()
+segments, polygons = MFgrid_utils.dissolve_array(IRUNBND, corners_x, corners_y)
+IRUNBND_dissolved = pd.DataFrame({'segment': segments, 'geometry': [shape(p) for p in polygons]})
 
-GISio.df2shp(MFgrid_joined_dissolved,
-             os.path.join(os.getcwd(), 'MFgrid_segments_dissolved.shp'),
+GISio.df2shp(IRUNBND_dissolved,
+             os.path.join(os.getcwd(), out_IRUNBND_shp),
              'geometry',
-             os.path.join(os.getcwd(), 'MFgrid_catchments.shp')[:-4]+'.prj')
+             prj)
@@ -0,0 +1,139 @@
+'''
+Hydrograph plots of NWIS water levels for wells with multiple measurements (used by process_NWIS_levels.py)
+
+Pages are rendered in batches by separate worker processes (this module is run as a script
+for each batch), and the batch PDFs are then merged into the final PDF.
+Merging requires pypdf or PyPDF2; without either, the batch PDFs are left in place.
+
+usage (by render_pdf):
+python NWIS_plots.py <pickled list of records> <output pdf>
+'''
+import os
+import sys
+import pickle
+import subprocess
+import time
+import matplotlib
+if __name__ == '__main__':
+    matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+
+
+def plot_hydrograph(record):
+    '''
+    plot measured water levels for a well, with pre and post-1970 averages
+
+    record: dict with dates (matplotlib date numbers), WLs, title, alt_acc, numWQ, codes,
+        and post1970/pre1970 dates, averages and standard deviations
+        (post1970, avg_post1970, std_post1970, pre1970, avg_pre1970, std_pre1970)
+
+    returns figure
+    '''
+    fig, ax1 = plt.subplots(1, 1, sharex=True, sharey=False)
+    ax1.grid(True)
+    ax1.plot(record['dates'], record['WLs'], 'bo', label='WLs')
+    ax1.xaxis_date()
+    plt.xticks(rotation=45, fontsize=10)
+    plt.yticks(fontsize=10)
+
+    info = (record['alt_acc'], record['numWQ'], record['codes'])
+    if len(record['post1970']) > 0:
+        ax1.plot(record['post1970'], record['avg_post1970'], 'r', label='post-1970 avg')
+        ax1.text(0.95, 0.05, 'stdev: %s\nalt accuracy: %s\nnum WQ: %s\nWell codes: %s'
+                 % ((round(record['std_post1970'], 2),) + info),
+                 verticalalignment='bottom', horizontalalignment='right', transform=ax1.transAxes)
+    if len(record['pre1970']) > 0:
+        ax1.plot(record['pre1970'], record['avg_pre1970'], 'g', label='pre-1970 avg')
+        ax1.text(0.05, 0.05, 'stdev: %s\nalt accuracy: %s\nnum WQ: %s\nWell codes: %s'
+                 % ((round(record['std_pre1970'], 2),) + info),
+                 verticalalignment='bottom', horizontalalignment='left', transform=ax1.transAxes)
+    handles, labels = ax1.get_legend_handles_labels()
+    ax1.legend(handles, labels)
+    ax1.set_title(record['title'])
+    return fig
+
+
+def render_batch(records, pdffile):
+    '''
+    write one page for each record to pdffile; figures are closed after each page
+    '''
+    pdf = PdfPages(pdffile)
+    for record in records:
+        fig = plot_hydrograph(record)
+        pdf.savefig(fig)
+        plt.close(fig)
+    pdf.close()
+
+
+def merge_pdfs(pdffiles, outfile):
+    '''
+    merge pdffiles (in order) into outfile; returns False if neither pypdf nor PyPDF2 is available
+    '''
+    try:
+        from pypdf import PdfWriter
+        merger = PdfWriter()
+    except ImportError:
+        try:
+            from PyPDF2 import PdfFileMerger
+            merger = PdfFileMerger()
+        except ImportError:
+            return False
+    for f in pdffiles:
+        merger.append(f)
+    with open(outfile, 'wb') as ofp:
+        merger.write(ofp)
+    return True
+
+
+def render_pdf(records, pdffile, processes=4, batchsize=50):
+    '''
+    render a hydrograph page for each record into pdffile
+
+    processes: maximum number of worker processes; 1 renders all pages in this process
+    batchsize: number of pages rendered by each worker process
+
+    returns list of PDF files written (pdffile, or the batch files if they couldn't be merged)
+    '''
+    if processes <= 1 or len(records) <= batchsize:
+        render_batch(records, pdffile)
+        return [pdffile]
+
+    batches = []
+    for i in range(0, len(records), batchsize):
+        batchname = '{}_batch{:04d}'.format(pdffile[:-4], i // batchsize)
+        with open(batchname + '.pkl', 'wb') as ofp:
+            pickle.dump(records[i:i + batchsize], ofp, pickle.HIGHEST_PROTOCOL)
+        batches.append(batchname)
+
+    # run up to processes workers at a time
+    pending = list(batches)
+    running = []
+    failed = []
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < processes:
+            batchname = pending.pop(0)
+            running.append((batchname, subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                                         batchname + '.pkl', batchname + '.pdf'])))
+        for batchname, p in list(running):
+            if p.poll() is not None:
+                running.remove((batchname, p))
+                os.remove(batchname + '.pkl')
+                if p.returncode != 0:
+                    failed.append(batchname)
+        time.sleep(0.1)
+    if len(failed) > 0:
+        raise RuntimeError('plotting failed for batches: {}'.format(', '.join(failed)))
+
+    batchfiles = [b + '.pdf' for b in batches]
+    if not merge_pdfs(batchfiles, pdffile):
+        return batchfiles
+    for f in batchfiles:
+        os.remove(f)
+    return [pdffile]
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1], 'rb') as infile:
+        records = pickle.load(infile)
+    render_batch(records, sys.argv[2])
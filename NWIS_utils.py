@@ -0,0 +1,367 @@
+'''
+Utilities for processing NWIS groundwater site and level files (used by process_NWIS_levels.py)
+'''
+import re
+import csv
+import operator
+import numpy as np
+import io_utils
+
+# per-well attributes from the NWIS site file, and their types
+site_columns = {'alt_va': float,
+                'alt_acy_va': float,
+                'well_depth_va': float,
+                'qw_count_nu': float,
+                'reliability_cd': str}
+
+# column types for NWIS RDB (tab-delimited) files; other columns are read as strings
+rdb_dtypes = dict(site_columns, lev_va=float, lev_dt='datetime64[D]')
+
+
+def to_str(values):
+    '''
+    array of stripped strings (decodes byte strings read by np.genfromtxt)
+    '''
+    return np.char.strip(np.asarray(values).astype(str))
+
+
+def to_datetime64(values, dtype='datetime64[D]'):
+    '''
+    array of datetime64 from YYYY-MM-DD strings; other values (including partial dates such as
+    YYYY-MM or YYYY, which are common in NWIS) become NaT
+    '''
+    values = to_str(values)
+    out = np.empty(values.shape, dtype=dtype)
+    out.fill(np.datetime64('NaT'))
+    full = np.char.str_len(values) == 10
+    try:
+        out[full] = values[full].astype(dtype)
+    except ValueError:
+        for i in np.where(full)[0]:
+            try:
+                out[i] = np.datetime64(values[i])
+            except ValueError:
+                pass
+    return out
+
+
+def read_rdb(filename, chunksize=100000, dtypes=rdb_dtypes, discard=None, discarded=None):
+    '''
+    read an NWIS RDB file (tab-delimited, with # comment lines, a header line, and a format line)
+    in chunks of at most chunksize rows, in one pass through the file
+
+    dtypes: dict of column types (float, str or a datetime64 type); other columns are read as strings
+    discard: optional dict of column: list of values; rows with these values are dropped while reading
+        (e.g. {'lev_status_cd': ['P','R','S','T','Z']})
+    discarded: optional dict updated with the number of dropped rows for each site_no
+
+    yields dicts of typed column arrays
+    '''
+    with open(filename) as infile:
+        names = None
+        lines = []
+        for line in infile:
+            if line.startswith('#') or len(line.strip()) == 0:
+                continue
+            if names is None:
+                names = line.rstrip('\r\n').split('\t')
+                next(infile) # skip format line
+                continue
+            lines.append(line)
+            if len(lines) == chunksize:
+                yield _parse_rdb_chunk(lines, names, dtypes, discard, discarded)
+                lines = []
+        if len(lines) > 0:
+            yield _parse_rdb_chunk(lines, names, dtypes, discard, discarded)
+
+
+def _parse_rdb_chunk(lines, names, dtypes, discard=None, discarded=None):
+    ncol = len(names)
+    rows = [line.rstrip('\r\n').split('\t') for line in lines]
+    rows = [r[:ncol] + [''] * (ncol - len(r)) for r in rows]
+    columns = dict(zip(names, [np.array(c) for c in zip(*rows)]))
+
+    if discard is not None:
+        keep = np.ones(len(rows), dtype=bool)
+        for name, values in discard.items():
+            keep &= ~np.isin(to_str(columns[name]), values)
+        if discarded is not None and 'site_no' in columns:
+            for site_no in to_str(columns['site_no'][~keep]):
+                discarded[str(site_no)] = discarded.get(str(site_no), 0) + 1
+        columns = dict((name, values[keep]) for name, values in columns.items())
+
+    chunk = {}
+    for name, values in columns.items():
+        dtype = dtypes.get(name, str)
+        if dtype == float:
+            chunk[name] = io_utils.to_float(values)
+        elif str(dtype).startswith('datetime64'):
+            chunk[name] = to_datetime64(values, dtype)
+        else:
+            chunk[name] = to_str(values)
+    return chunk
+
+
+def concat_chunks(chunks):
+    '''
+    combine chunks of column arrays (e.g. from read_rdb) into one dict of arrays
+    '''
+    chunks = list(chunks)
+    if len(chunks) == 0:
+        return {}
+    return dict((name, np.concatenate([c[name] for c in chunks])) for name in chunks[0])
+
+
+def parse_sites(info):
+    '''
+    typed columns (dict of arrays) for the site_no and per-well attributes in an NWIS site table
+    (e.g. structured array from np.genfromtxt(..., names=True, dtype=None))
+    '''
+    sites = {'site_no': to_str(info['site_no'])}
+    for col, dtype in site_columns.items():
+        if dtype == float:
+            sites[col] = io_utils.to_float(info[col])
+        else:
+            sites[col] = to_str(info[col])
+    return sites
+
+
+def site_index(site_nos, sites):
+    '''
+    index of each site_no in the site table, by a sorted-array join (O(n log n) instead of
+    searching the whole table for each value)
+
+    site_nos: array of site numbers (e.g. from the levels file)
+    sites: dict of site columns (see parse_sites)
+
+    returns array of indices into sites, with -1 for site numbers that aren't in the table;
+    for site numbers listed more than once in the table, the first entry is used
+    '''
+    site_nos = to_str(site_nos)
+    order = np.argsort(sites['site_no'], kind='mergesort')
+    sorted_sites = sites['site_no'][order]
+    if len(sorted_sites) == 0:
+        return np.zeros(len(site_nos), dtype=int) - 1
+    pos = np.clip(np.searchsorted(sorted_sites, site_nos), 0, len(sorted_sites) - 1)
+    found = sorted_sites[pos] == site_nos
+    return np.where(found, order[pos], -1)
+
+
+def join_sites(site_nos, sites):
+    '''
+    per-well attributes for each site_no, in one vectorized join (see site_index)
+    raises ValueError if any site_no isn't in the site table
+
+    returns dict of arrays with same length as site_nos
+    '''
+    inds = site_index(site_nos, sites)
+    missing = inds < 0
+    if missing.any():
+        raise ValueError('sites not found in site table: {}'.format(', '.join(np.unique(to_str(site_nos)[missing]))))
+    return dict((col, values[inds]) for col, values in sites.items())
+
+
+def grouped_std(groups, values, ngroups):
+    '''
+    standard deviation of values for each group (groups: integer group index of each value);
+    nan values are ignored, and groups without values get nan
+    '''
+    valid = ~np.isnan(values)
+    groups, values = groups[valid], values[valid]
+    n = np.bincount(groups, minlength=ngroups).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(groups, weights=values, minlength=ngroups) / n
+        dev = values - mean[groups]
+        return np.sqrt(np.bincount(groups, weights=dev**2, minlength=ngroups) / n)
+
+
+def well_statistics(well_idx, dates, WLs, codes, nwells, cutoff='1970-01-01'):
+    '''
+    summary statistics for classifying wells, computed for all wells at once
+
+    well_idx: well index (0 to nwells-1) of each measurement, with measurements for each well in date order
+    dates: datetime64 array of measurement dates
+    WLs: water level elevations (nan for missing levels)
+    codes: lev_status_cd of each measurement
+
+    returns dict of arrays (nwells) with
+    post1970: whether the well has measurements after the cutoff date
+    n: number of measurements after the cutoff (all measurements for wells with none after the cutoff)
+    std: standard deviation of the same set of levels (missing levels are ignored)
+    artesian: first level is missing, and the well has flowing (F) or (E) status codes
+    '''
+    well_idx = np.asarray(well_idx, dtype=int)
+    post = np.asarray(dates) > np.datetime64(cutoff)
+    n_all = np.bincount(well_idx, minlength=nwells)
+    n_post = np.bincount(well_idx[post], minlength=nwells)
+    std_all = grouped_std(well_idx, WLs, nwells)
+    std_post = grouped_std(well_idx[post], WLs[post], nwells)
+    post1970 = n_post > 0
+
+    first = np.zeros(nwells, dtype=bool)
+    wells, first_ind = np.unique(well_idx, return_index=True)
+    first[wells] = np.isnan(WLs[first_ind])
+    flowing = np.bincount(well_idx, weights=np.isin(to_str(codes), ['F', 'E']), minlength=nwells) > 0
+
+    return {'post1970': post1970,
+            'n': np.where(post1970, n_post, n_all),
+            'std': np.where(post1970, std_post, std_all),
+            'artesian': first & flowing}
+
+
+# rules for assigning quality categories to wells; the first matching rule is used
+# (wells that match none are 'poor'). Conditions are on the columns from well_statistics,
+# plus reliability (reliability_cd), alt_acc (alt_acy_va), and numWQ (qw_count_nu)
+classification_rules = [
+    # checked by reporting agency (reliability_cd C); measurements after 1970
+    ('best', 'reliability==C; post1970==1; n>2; alt_acc<=5; std<=5'),
+    ('good', 'reliability==C; post1970==1; n>2; alt_acc<=5; std<=10'),
+    ('fair', 'reliability==C; post1970==1; n>2; alt_acc<=5'),
+    ('best', 'reliability==C; post1970==1; n>30; alt_acc<=10; std<=5'),
+    ('good', 'reliability==C; post1970==1; n>30; alt_acc<=10; std<=10'),
+    ('fair', 'reliability==C; post1970==1; n>30; alt_acc<=10'),
+    ('good', 'reliability==C; post1970==1; n>2; alt_acc<=10; std<=10'),
+    ('fair', 'reliability==C; post1970==1; n>2; alt_acc<=10'),
+    ('good', 'reliability==C; post1970==1; n==2; alt_acc<=5; std<=10'),
+    ('fair', 'reliability==C; post1970==1; n==2; alt_acc<=5'),
+    ('good', 'reliability==C; post1970==1; n==1; alt_acc<5'),
+    ('good', 'reliability==C; post1970==1; n==1; numWQ>0; alt_acc<=5'),
+    ('good', 'reliability==C; post1970==1; n==1; artesian==1; alt_acc<=5'),
+    ('fair', 'reliability==C; post1970==1; n==1; alt_acc<=10'),
+    # checked by reporting agency; only measurements before 1970
+    ('good', 'reliability==C; post1970==0; n>2; alt_acc<=5; std<=10'),
+    ('fair', 'reliability==C; post1970==0; n>2; alt_acc<=5'),
+    ('fair', 'reliability==C; post1970==0; alt_acc<=10'),
+    # not checked by reporting agency (reliability_cd U); keep only wells with 2+ measurements after 1970,
+    # std<=10, and alt accuracy <=10
+    ('good', 'reliability==U; post1970==1; n>2; alt_acc<=5; std<=5'),
+    ('good', 'reliability==U; post1970==1; n>30; alt_acc>5; alt_acc<=10; std<=5'),
+    ('fair', 'reliability==U; post1970==1; n>2; n<=30; alt_acc>5; alt_acc<=10; std<=10'),
+]
+
+_operators = {'<=': operator.le, '>=': operator.ge, '==': operator.eq, '!=': operator.ne,
+              '<': operator.lt, '>': operator.gt}
+_condition = re.compile(r'^\s*(\w+)\s*(<=|>=|==|!=|<|>)\s*(.+?)\s*$')
+
+
+def parse_conditions(conditions):
+    '''
+    list of (column, operator, value) from a string of conditions separated by semicolons
+    (e.g. 'n>2; alt_acc<=5'); values are converted to floats where possible
+    '''
+    parsed = []
+    for condition in conditions.split(';'):
+        if len(condition.strip()) == 0:
+            continue
+        match = _condition.match(condition)
+        if match is None:
+            raise ValueError('could not parse classification condition: {}'.format(condition))
+        column, op, value = match.groups()
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+        parsed.append((column, op, value))
+    return parsed
+
+
+def read_rules(rulesfile):
+    '''
+    read classification rules from a csv file with columns category,conditions
+    (same form as classification_rules; e.g. best,reliability==C; post1970==1; n>2; alt_acc<=5; std<=5)
+    '''
+    rules = []
+    with open(rulesfile) as infile:
+        for row in csv.reader(infile):
+            if len(row) < 2 or row[0].strip().lower() == 'category':
+                continue
+            rules.append((row[0].strip(), ','.join(row[1:])))
+    return rules
+
+
+def classify(columns, rules=classification_rules, default='poor'):
+    '''
+    assign a category to each well by evaluating the rules over all wells at once
+
+    columns: dict of arrays (one value per well) referenced by the rule conditions
+    rules: list of (category, conditions); the first matching rule is used
+
+    returns array of categories
+    '''
+    nwells = len(next(iter(columns.values())))
+    categories = np.array([default] * nwells, dtype=object)
+    unassigned = np.ones(nwells, dtype=bool)
+    for category, conditions in rules:
+        match = unassigned.copy()
+        for column, op, value in parse_conditions(conditions):
+            with np.errstate(invalid='ignore'):
+                match &= _operators[op](columns[column], value)
+        categories[match] = category
+        unassigned &= ~match
+    return categories
+
+
+def unique_names(names, suffix_len=5, maxlen=15):
+    '''
+    make observation names unique in one pass, within a name length limit (GFLOW and PEST
+    have observation name length limits)
+
+    names: dict of site_no: name, where each name is a substring of site_no followed by a
+        suffix of suffix_len characters (e.g. '88592501_good')
+    maxlen: maximum name length
+
+    Names that are unique and within maxlen are kept. Longer names are shortened to the last
+    maxlen - suffix_len characters of their substring, followed by the suffix. The first well with a name
+    (by site_no) keeps it; the others get the first unused name from other substrings of their site_no
+    (maxlen - suffix_len characters, moving toward the start of site_no), and then (if those are all taken)
+    from the shortened substring with its end replaced by a counter.
+
+    returns dict of site_no: unique name, and dict of site_no: (old name, new name) for renamed wells
+    (duplicates, and names shortened to maxlen)
+
+    >>> unique, renamed = unique_names({'4342380885925': '80885925_good', '123': '_good'})
+    >>> unique['4342380885925'], unique['123'], renamed
+    ('80885925_good', '_good', {})
+    >>> unique_names({'4342380885925': '80885925_good', '5342380885925': '80885925_good'})[1]
+    {'5342380885925': ('80885925_good', '2380885925_good')}
+    '''
+    width = maxlen - suffix_len
+    sites = sorted(names.keys())
+    windows = {}
+    for site_no in sites:
+        base = names[site_no][:-suffix_len]
+        # characters to take substrings from, and the end of the default substring
+        source = site_no if base in site_no else base
+        end = source.rfind(base) + len(base)
+        windows[site_no] = (source, max(end - width, 0), end)
+    defaults = dict((site_no, names[site_no] if len(names[site_no]) <= maxlen else
+                     source[start:end] + names[site_no][-suffix_len:])
+                    for site_no, (source, start, end) in windows.items())
+    used = set(defaults.values())
+    seen = set()
+    unique = {}
+    renamed = {}
+    for site_no in sites:
+        name = names[site_no]
+        suffix = name[-suffix_len:]
+        source, start, end = windows[site_no]
+        newname = defaults[site_no]
+        if newname in seen:
+            candidates = (source[i:i + width] + suffix for i in range(start, -1, -1))
+            newname = None
+            for candidate in candidates:
+                if candidate not in used:
+                    newname = candidate
+                    break
+            k = 1
+            while newname is None:
+                candidate = source[start:min(start + width, end) - len(str(k))] + str(k) + suffix
+                if candidate not in used:
+                    newname = candidate
+                k += 1
+            used.add(newname)
+        seen.add(newname)
+        unique[site_no] = newname
+        if newname != name:
+            renamed[site_no] = (name, newname)
+    return unique, renamed
@@ -0,0 +1,60 @@
+'''
+Benchmark of per-level site lookups in process_NWIS_levels.py:
+searching the whole site table for each level (np.where scan; O(levels x sites))
+versus joining the levels to the site table once (NWIS_utils.join_sites; O((levels + sites) log sites))
+
+Uses synthetic site and levels tables of increasing size (10 levels per site).
+Scans are skipped for the larger tables, where they take too long.
+'''
+from __future__ import print_function
+import time
+import numpy as np
+import NWIS_utils
+
+sizes = [100, 1000, 10000, 100000]
+levels_per_site = 10
+max_scan_size = 10000
+
+
+def make_tables(nsites, seed=0):
+    rs = np.random.RandomState(seed)
+    site_no = np.array(['{:015d}'.format(430000000000000 + s * 7919) for s in rs.permutation(nsites)])
+    info = {'site_no': site_no,
+            'alt_va': np.array(['{:.1f}'.format(v) for v in rs.uniform(600, 1500, nsites)]),
+            'alt_acy_va': np.array(['{:.0f}'.format(v) for v in rs.choice([1, 5, 10, 20], nsites)]),
+            'well_depth_va': np.array(['{:.0f}'.format(v) for v in rs.uniform(20, 500, nsites)]),
+            'qw_count_nu': np.array(['{:.0f}'.format(v) for v in rs.poisson(1, nsites)]),
+            'reliability_cd': rs.choice(['C', 'U'], nsites)}
+    levels_site_no = rs.choice(site_no, nsites * levels_per_site)
+    return info, levels_site_no
+
+
+def scan(info, levels_site_no):
+    elevations = []
+    for wellnum in levels_site_no:
+        info_ind = np.where(info['site_no'] == wellnum)[0][0]
+        elevations.append(float(info['alt_va'][info_ind].strip()))
+    return np.array(elevations)
+
+
+def join(info, levels_site_no):
+    sites = NWIS_utils.parse_sites(info)
+    return NWIS_utils.join_sites(levels_site_no, sites)['alt_va']
+
+
+print('{:>10s} {:>10s} {:>12s} {:>12s}'.format('sites', 'levels', 'scan (s)', 'join (s)'))
+for nsites in sizes:
+    info, levels_site_no = make_tables(nsites)
+
+    t0 = time.time()
+    joined = join(info, levels_site_no)
+    tjoin = time.time() - t0
+
+    tscan = np.nan
+    if nsites <= max_scan_size:
+        t0 = time.time()
+        scanned = scan(info, levels_site_no)
+        tscan = time.time() - t0
+        assert np.allclose(scanned, joined)
+
+    print('{:>10d} {:>10d} {:>12.3f} {:>12.3f}'.format(nsites, len(levels_site_no), tscan, tjoin))
@@ -2,71 +2,70 @@
 # Uses exported matrices from Groundwater Vistas, and a WEL file with boundary fluxes
 # Outputs new boundary cells to r,c,l,flux csv for input back into GWV
 # for applying GFLOW solution, best way would be to base transmissivities on saturated thickness
+# (set headsfile to a GWV matrix of the GFLOW heads)
 
 import numpy as np
-from collections import defaultdict
+import GWV_utils
+import grid_utils
+import listpackage_utils
 
 # hard coded model dimensions
 rows=800
 columns=800
-layers=5
+# layers will be based on length of input GWV matrix and number of cells
 
 # Input files
 botsfile='BR_L1L5bot.DAT' # GWV mat with bottom elevations for all layers
 l1topfile='L1top.DAT' # GWV mat with top elevations for layer 1
 Kfile='BR_Kmat.DAT' # GWV mat with K values for all layers
 bfluxfile='BR_KC.wel' # WEL file with boundary fluxes
+headsfile=None # optional GWV mat of heads (one water table surface, or one for each layer); T is then based on saturated thickness
 
 # hard coded wel file settings
 field_width=10 # set field width to zero if wel file is delimited instead of fixed
-header=2 #lines
 
 # output file
 outfile='Bflux_alllayers.csv'
 
-# load in GWV matricies
-bots=np.fromfile(botsfile,sep=" ")
-bots_rs=bots.reshape(layers,rows,columns) # apparently np convention is l,r,c
-l1top=np.fromfile(l1topfile,sep=" ")
-l1top=l1top.reshape(rows,columns)
-Kx=np.fromfile(Kfile,sep=" ")
-Kx_rs=Kx.reshape(layers,rows,columns)
-
-tops=np.append(l1top,bots_rs[0:(layers-1),:,:])
-tops_rs=tops.reshape(layers,rows,columns)
-
-thicknesses=tops_rs-bots_rs
-
-cellnums=np.reshape(np.arange(1,(rows*columns+1)),(rows,columns))
-
-if field_width>0:
-    bflux=np.genfromtxt(bfluxfile,skip_header=header,delimiter=field_width,dtype=None)
+# load in GWV matricies (binary copies are cached in .gwv_cache after the first run)
+grid=grid_utils.ModelGrid.from_GWV(botsfile,l1topfile,rows,columns,Kfile=Kfile)
+if headsfile is None:
+    T=grid.transmissivity # l,r,c
 else:
-    bflux=np.genfromtxt(bfluxfile,skip_header=header,dtype=None)
-bflux=list(bflux)
-
-
-bcells=defaultdict()
-for line in bflux:
-    bcellnum=(int(line[1])-1)*columns+int(line[2])
-    bcells.setdefault(str(bcellnum),[line[1],line[2],line[3]]) # rows, cols, fluxes
-
+    heads=GWV_utils.load_matrix(headsfile,shape=(-1,rows,columns))
+    T=grid.saturated_transmissivity(heads if heads.shape[0]>1 else heads[0])
+layers=grid.nlay
+
+# boundary cells and fluxes for the first stress period
+bcells,bflux=listpackage_utils.read_first_period(bfluxfile,'WEL',field_width=field_width or None)
+
+# one flux for each boundary cell (the first listed, where a cell is listed more than once)
+bcellnums=(bcells[:,1]-1)*columns+bcells[:,2]
+bcellnums,first=np.unique(bcellnums,return_index=True)
+r=bcells[first,1]-1 # zero-based indexing
+c=bcells[first,2]-1
+totalflux=bflux[first,0]
+
+# split each flux among the layers in proportion to T (all cells at once);
+# cells with no transmissivity in any layer are split evenly
+Tvalues=T[:,r,c] # layers x cells
+Ttotal=Tvalues.sum(axis=0)
+noT=Ttotal<=0
+fractions=np.empty(Tvalues.shape)
+fractions[:,~noT]=Tvalues[:,~noT]/Ttotal[~noT]
+fractions[:,noT]=1./layers
+flux=fractions*totalflux
+if noT.any():
+    print '%s boundary cells with zero transmissivity; fluxes split evenly among layers' %(noT.sum())
 
 ofp=open(outfile,'w')
 ofp.write('row,column,layer,flux\n')
-for cell in bcells.iterkeys():
-    r=bcells[cell][0]-1 # zero-based indexing
-    c=bcells[cell][1]-1
-    Kvalues=Kx_rs[0:,r,c]
-    bvalues=thicknesses[0:,r,c]
-    Tvalues=Kvalues*bvalues
-    Ttotal=sum(Tvalues)
-    totalflux=bcells[cell][2]
-    for l in range(layers):
-        flux=totalflux*Tvalues[l]/Ttotal
-        ofp.write('%s,%s,%s,%s\n' %(r+1,c+1,l+1,flux))
+ofp.write(''.join(['%s,%s,%s,%s\n' %line for line in
+                   zip(np.repeat(r+1,layers),np.repeat(c+1,layers),np.tile(np.arange(1,layers+1),len(r)),flux.T.ravel())]))
 ofp.close()
-            
+
+
+
 
 
 
@@ -80,7 +79,7 @@ ofp.close()
 #plot up thicknesses:
 for l in range(layers):
     plt.figure(l)
-    plt.imshow(thicknesses[l,:,:])
+    plt.imshow(grid.thickness[l,:,:])
     plt.colorbar()
     plt.draw()
     
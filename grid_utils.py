@@ -0,0 +1,337 @@
+'''
+Structured MODFLOW grid information shared by the scripts in this folder
+
+ModelGrid holds the layer elevations as a single (nlay+1, nrow, ncol) array
+(model top, followed by the bottom of each layer), so that the layer tops and bottoms
+are views into the same memory instead of separate copies.
+Thickness and transmissivity are computed the first time they are requested and then kept.
+
+usage:
+import grid_utils
+grid = grid_utils.ModelGrid.from_GWV('BR_L1L5bot.DAT', 'L1top.DAT', 800, 800, Kfile='BR_Kmat.DAT',
+                                     xll=649521.5, yll=5116116.1, delr=76.2, delc=76.2)
+T = grid.transmissivity
+'''
+import numpy as np
+import GWV_utils
+
+
+class ModelGrid(object):
+    '''
+    elevations: (nlay+1, nrow, ncol) array of model top and layer bottoms
+    K: optional (nlay, nrow, ncol) array of horizontal hydraulic conductivity
+    delr, delc: column widths and row heights (scalar or 1D array)
+    xll, yll: coordinates of the lower left corner of the grid
+    rotation: counter-clockwise rotation of the grid about its lower left corner, in degrees
+    float32: store elevations (and K) as 32-bit floats to halve memory use
+    '''
+    __slots__ = ['elevations', 'delr', 'delc', 'xll', 'yll', 'rotation', '_K', '_thickness', '_transmissivity']
+
+    def __init__(self, elevations, K=None, delr=1., delc=1., xll=0., yll=0., rotation=0., float32=False):
+        dtype = np.float32 if float32 else np.float64
+        self.elevations = np.asarray(elevations, dtype=dtype)
+        if self.elevations.ndim != 3:
+            raise ValueError('elevations must be (nlay+1, nrow, ncol); got shape {}'.format(self.elevations.shape))
+        nrow, ncol = self.elevations.shape[1:]
+        self.delr = np.ones(ncol) * delr
+        self.delc = np.ones(nrow) * delc
+        self.xll = xll
+        self.yll = yll
+        self.rotation = rotation
+        self._K = None
+        self._thickness = None
+        self._transmissivity = None
+        if K is not None:
+            self.K = K
+
+    @classmethod
+    def from_arrays(cls, top, bots, **kwargs):
+        '''
+        build grid from a 2D model top and a 3D array of layer bottoms
+        (one copy is made, into the combined elevation array)
+        '''
+        bots = np.asarray(bots)
+        dtype = np.float32 if kwargs.get('float32') else np.float64
+        elevations = np.empty((bots.shape[0] + 1,) + bots.shape[1:], dtype=dtype)
+        elevations[0] = top
+        elevations[1:] = bots
+        return cls(elevations, **kwargs)
+
+    @classmethod
+    def from_GWV(cls, botsfile, l1topfile, rows, columns, Kfile=None, **kwargs):
+        '''
+        build grid from Groundwater Vistas matrix exports of layer bottoms, model top, and (optionally) K
+        number of layers is based on the length of botsfile
+        '''
+        dtype = np.float32 if kwargs.get('float32') else np.float64
+        bots = GWV_utils.load_matrix(botsfile, shape=(-1, rows, columns), dtype=dtype)
+        top = GWV_utils.load_matrix(l1topfile, shape=(rows, columns), dtype=dtype)
+        if Kfile is not None:
+            kwargs['K'] = GWV_utils.load_matrix(Kfile, shape=bots.shape, dtype=dtype)
+        return cls.from_arrays(top, bots, **kwargs)
+
+    @classmethod
+    def from_DIS(cls, DISfile, **kwargs):
+        '''
+        build grid from a MODFLOW DIS file (elevations, delr and delc; see DIS_utils.read_dis)
+        '''
+        import DIS_utils
+        dis = DIS_utils.read_dis(DISfile)
+        kwargs.setdefault('delr', dis['delr'])
+        kwargs.setdefault('delc', dis['delc'])
+        return cls.from_arrays(dis['top'], dis['botm'], **kwargs)
+
+    @property
+    def shape(self):
+        return (self.nlay, self.nrow, self.ncol)
+
+    @property
+    def nlay(self):
+        return self.elevations.shape[0] - 1
+
+    @property
+    def nrow(self):
+        return self.elevations.shape[1]
+
+    @property
+    def ncol(self):
+        return self.elevations.shape[2]
+
+    @property
+    def top(self):
+        return self.elevations[0]
+
+    @property
+    def tops(self):
+        return self.elevations[:-1]
+
+    @property
+    def bots(self):
+        return self.elevations[1:]
+
+    @property
+    def K(self):
+        return self._K
+
+    @K.setter
+    def K(self, K):
+        K = np.asarray(K, dtype=self.elevations.dtype)
+        if K.shape != self.shape:
+            raise ValueError('K must have shape {}; got {}'.format(self.shape, K.shape))
+        self._K = K
+        self._transmissivity = None
+
+    @property
+    def thickness(self):
+        if self._thickness is None:
+            self._thickness = self.tops - self.bots
+        return self._thickness
+
+    @property
+    def transmissivity(self):
+        if self._K is None:
+            raise ValueError('transmissivity requires K')
+        if self._transmissivity is None:
+            self._transmissivity = self._K * self.thickness
+        return self._transmissivity
+
+    def saturated_thickness(self, heads):
+        '''
+        saturated thickness of each layer for a head array; (nrow, ncol) for a single water table surface
+        (e.g. from a GFLOW solution), or (nlay, nrow, ncol). Zero where the head is below the layer bottom.
+        '''
+        heads = np.asarray(heads, dtype=self.elevations.dtype)
+        return np.clip(np.minimum(heads, self.tops) - self.bots, 0, None)
+
+    def saturated_transmissivity(self, heads):
+        '''
+        transmissivity based on the saturated thickness of each layer (see saturated_thickness); not kept
+        '''
+        if self._K is None:
+            raise ValueError('transmissivity requires K')
+        return self._K * self.saturated_thickness(heads)
+
+    @property
+    def cellnums(self):
+        '''1-based cell numbers ((row-1)*ncol + column), by row and column'''
+        return np.arange(1, self.nrow * self.ncol + 1).reshape(self.nrow, self.ncol)
+
+    @property
+    def xcenters(self):
+        '''x coordinates of column centers (unrotated)'''
+        return self.xll + np.cumsum(self.delr) - 0.5 * self.delr
+
+    @property
+    def ycenters(self):
+        '''y coordinates of row centers (unrotated; row 1 is at the top of the grid)'''
+        return self.yll + (np.cumsum(self.delc[::-1]) - 0.5 * self.delc[::-1])[::-1]
+
+    def locate(self, x, y):
+        '''
+        row, column, ROFF, COFF and inside-domain mask for arrays of x, y coordinates (see locate_points)
+        '''
+        return locate_points(x, y, self.delr, self.delc, self.xll, self.yll, self.rotation)
+
+    def cell_centers(self):
+        '''
+        x and y coordinates (nrow, ncol) of the cell centers, including the grid rotation (see cell_centers)
+        '''
+        return cell_centers(self.delr, self.delc, self.xll, self.yll, self.rotation)
+
+    def cell_corners(self):
+        '''
+        x and y coordinates (nrow+1, ncol+1) of the cell corners, including the grid rotation (see cell_corners)
+        '''
+        return cell_corners(self.delr, self.delc, self.xll, self.yll, self.rotation)
+
+    def reset(self):
+        '''
+        discard computed thickness and transmissivity (call after modifying elevations in place)
+        '''
+        self._thickness = None
+        self._transmissivity = None
+
+
+def locate_points(x, y, delr, delc, xll=0., yll=0., rotation=0.):
+    '''
+    locate any number of points in a structured grid
+
+    x, y: arrays of point coordinates
+    delr, delc: 1D arrays of column widths and row heights
+    xll, yll: coordinates of the lower left corner of the grid
+    rotation: counter-clockwise rotation of the grid about its lower left corner, in degrees
+
+    returns row, column, ROFF, COFF, inside
+    row, column: 1-based; 0 for points outside of the grid
+    ROFF, COFF: offsets of each point from its cell center, as fractions of the cell height and width,
+        measured in the direction of increasing row and column (MODFLOW Observation Process convention);
+        nan for points outside of the grid
+    inside: boolean mask of points within the grid
+    '''
+    x = np.atleast_1d(np.asarray(x, dtype=float)) - xll
+    y = np.atleast_1d(np.asarray(y, dtype=float)) - yll
+    if rotation:
+        theta = np.radians(rotation)
+        x, y = x * np.cos(theta) + y * np.sin(theta), -x * np.sin(theta) + y * np.cos(theta)
+
+    delr = np.atleast_1d(np.asarray(delr, dtype=float))
+    delc = np.atleast_1d(np.asarray(delc, dtype=float))
+    xedges = np.append(0., np.cumsum(delr))
+    yedges = np.append(0., np.cumsum(delc)) # distance down from the top of the grid
+    y = yedges[-1] - y
+
+    inside = (x > 0) & (x < xedges[-1]) & (y > 0) & (y < yedges[-1])
+    j = np.clip(np.searchsorted(xedges, x, side='right') - 1, 0, len(delr) - 1)
+    i = np.clip(np.searchsorted(yedges, y, side='right') - 1, 0, len(delc) - 1)
+
+    COFF = np.where(inside, (x - xedges[j] - 0.5 * delr[j]) / delr[j], np.nan)
+    ROFF = np.where(inside, (y - yedges[i] - 0.5 * delc[i]) / delc[i], np.nan)
+    row = np.where(inside, i + 1, 0)
+    column = np.where(inside, j + 1, 0)
+    return row, column, ROFF, COFF, inside
+
+
+def _to_world(x, y, xll=0., yll=0., rotation=0.):
+    # grid coordinates (from the lower left corner, along the rows and columns) to world coordinates;
+    # inverse of the transform in locate_points
+    if rotation:
+        theta = np.radians(rotation)
+        x, y = x * np.cos(theta) - y * np.sin(theta), x * np.sin(theta) + y * np.cos(theta)
+    return xll + x, yll + y
+
+
+def cell_centers(delr, delc, xll=0., yll=0., rotation=0.):
+    '''
+    x and y coordinates (nrow, ncol) of the cell centers of a structured grid (row 1 at the top)
+
+    delr, delc: 1D arrays of column widths and row heights
+    xll, yll: coordinates of the lower left corner of the grid
+    rotation: counter-clockwise rotation of the grid about its lower left corner, in degrees
+    '''
+    delr = np.atleast_1d(np.asarray(delr, dtype=float))
+    delc = np.atleast_1d(np.asarray(delc, dtype=float))
+    x = np.cumsum(delr) - 0.5 * delr
+    y = delc.sum() - (np.cumsum(delc) - 0.5 * delc)
+    x, y = np.meshgrid(x, y)
+    return _to_world(x, y, xll, yll, rotation)
+
+
+def cell_corners(delr, delc, xll=0., yll=0., rotation=0.):
+    '''
+    x and y coordinates (nrow+1, ncol+1) of the cell corners of a structured grid (see cell_centers)
+    '''
+    delr = np.atleast_1d(np.asarray(delr, dtype=float))
+    delc = np.atleast_1d(np.asarray(delc, dtype=float))
+    x, y = np.meshgrid(np.append(0., np.cumsum(delr)), delc.sum() - np.append(0., np.cumsum(delc)))
+    return _to_world(x, y, xll, yll, rotation)
+
+
+def screen_fractions(sctop, scbot, elevations, decimals=3, max_outside=0.01, names=None):
+    '''
+    portion of each well screen within each model layer, for any number of wells at once
+
+    sctop, scbot: arrays of screen top and bottom elevations (n_obs)
+    elevations: (n_obs, nlay+1) array of model top and layer bottoms at each well
+        (e.g. grid.elevations[:, rows-1, columns-1].T)
+    decimals: fractions are rounded to this many decimal places; the rounding residual is added to
+        the layer with the largest fraction, so that each row still sums to 1 (required by MODFLOW)
+    max_outside: largest fraction of a screen that can be above the model top or below the model bottom;
+        a ValueError lists the wells with more (usually bad screen elevations). None allows any.
+    names: optional well names for the error message (default is the index of each well)
+
+    returns (n_obs, nlay) array of fractions; each row sums to 1, except for screens entirely
+    outside of the model layers, which have all zeros. Portions of screens above the model top
+    or below the model bottom (up to max_outside) are ignored. Screens of zero length are assigned
+    to the layer containing them.
+    '''
+    sctop = np.atleast_1d(np.asarray(sctop, dtype=float))[:, np.newaxis]
+    scbot = np.atleast_1d(np.asarray(scbot, dtype=float))[:, np.newaxis]
+    elevations = np.atleast_2d(elevations)
+    tops = elevations[:, :-1]
+    bots = elevations[:, 1:]
+
+    # length of screen between the top and bottom of each layer
+    overlap = np.minimum(sctop, tops) - np.maximum(scbot, bots)
+    np.clip(overlap, 0, None, out=overlap)
+
+    points = (sctop <= scbot)[:, 0]
+    if points.any():
+        overlap[points] = (bots[points] < sctop[points]) & (sctop[points] <= tops[points])
+
+    total = overlap.sum(axis=1)
+    inside = total > 0
+    if max_outside is not None:
+        length = (sctop - scbot)[:, 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            outside = inside & ~points & (total < (1 - max_outside) * length)
+        if outside.any():
+            wells = np.where(outside)[0] if names is None else np.asarray(names)[outside]
+            raise ValueError('more than {:g} of the screened interval is above the model top or below the model bottom '
+                             'for {}'.format(max_outside, ', '.join(str(w) for w in wells)))
+    fractions = np.zeros(overlap.shape)
+    fractions[inside] = overlap[inside] / total[inside, np.newaxis]
+
+    if decimals is not None and inside.any():
+        fractions = np.round(fractions, decimals)
+        rows = np.where(inside)[0]
+        imax = fractions[rows].argmax(axis=1)
+        fractions[rows, imax] = np.round(fractions[rows, imax] + 1 - fractions[rows].sum(axis=1), decimals)
+    return fractions
+
+
+def enforce_min_thickness(elevations, min_thickness=1.):
+    '''
+    lower layer bottoms where needed so that each layer is at least min_thickness thick,
+    working down from the model top (the top is not changed)
+
+    elevations: (nlay+1, ...) array of model top and layer bottoms (e.g. grid.elevations,
+        or grid.elevations[:, rows, columns] for selected cells)
+
+    Each bottom becomes min(bottom, bottom of the layer above - min_thickness); this is computed for all
+    layers at once as a running minimum of the elevations offset by min_thickness per layer.
+
+    returns corrected copy of elevations
+    '''
+    elevations = np.asarray(elevations, dtype=float)
+    offset = (np.arange(elevations.shape[0]) * min_thickness).reshape((-1,) + (1,) * (elevations.ndim - 1))
+    return np.minimum.accumulate(elevations + offset, axis=0) - offset
@@ -0,0 +1,37 @@
+'''
+Small file and text helpers shared by the other utilities
+'''
+import os
+import numpy as np
+
+
+def replace_file(src, dst):
+    '''
+    rename src to dst, replacing dst if it exists (os.rename won't overwrite on Windows);
+    used to put files written under a temporary name in place
+    '''
+    if os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def to_float(values):
+    '''
+    array of floats from strings (or byte strings), in any shape; blank or unreadable values
+    (e.g. asterisks for values that overflow a MODFLOW output format) become nan
+    '''
+    if np.asarray(values).dtype.kind in 'fiu':
+        return np.asarray(values, dtype=float)
+    values = np.char.strip(np.asarray(values).astype(str))
+    out = np.empty(values.shape)
+    out.fill(np.nan)
+    valid = values != ''
+    try:
+        out[valid] = values[valid].astype(float)
+    except ValueError:
+        for i in zip(*np.where(valid)):
+            try:
+                out[i] = float(values[i])
+            except ValueError:
+                pass
+    return out
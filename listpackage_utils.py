@@ -0,0 +1,259 @@
+'''
+Readers and writers for MODFLOW list-based boundary condition packages (WEL, GHB, RIV, DRN, CHD)
+
+Packages are read in free format, or in fixed format (fields of field_width characters). Comment lines (#)
+and PEST template (ptf) markers are kept with the header, item 1 (MXACT, IxxxCB, options including
+AUX variables) is followed by ITMP (and NP) for each stress period, and then ITMP lines of
+Layer Row Column, the package variables, and any auxiliary variables. ITMP < 0 reuses the
+records of the previous stress period (see period_records). Comment and blank lines between
+stress periods are kept with the ITMP line that follows them (or at the end of the file).
+
+Records for all stress periods are held in one structured array (data), so that operations such as
+layer reassignment can be done for all records at once. Each block of records is parsed in bulk
+with numpy; blocks that can't be (e.g. PEST template parameters such as ~ cond1 ~) are parsed
+line by line, with nan for values that aren't numbers. The lines are also kept as read, so that
+files are written back unchanged except for records with new cells (or new values, with from_values=True).
+
+usage:
+import listpackage_utils
+pkg = listpackage_utils.read_package('BadRiver.ghb')
+pkg['data']['k'] += 1
+listpackage_utils.write_package('BadRiver_new.ghb', pkg)
+'''
+import os
+import re
+import numpy as np
+import io_utils
+
+# package variables after Layer Row Column
+package_variables = {'WEL': ['q'],
+                     'GHB': ['bhead', 'cond'],
+                     'RIV': ['stage', 'cond', 'rbot'],
+                     'DRN': ['elev', 'cond'],
+                     'CHD': ['shead', 'ehead']}
+
+# variable with the elevation that must be within the model cell
+elevation_variables = {'GHB': 'bhead', # boundary head
+                       'DRN': 'elev', # drain elevation
+                       'RIV': 'rbot'} # river bottom
+
+
+def _is_comment(line):
+    return line.strip() == '' or line.lstrip().startswith('#') or line.lower().startswith('ptf')
+
+
+def _aux_names(item1):
+    # auxiliary variable names from the options in item 1
+    tokens = item1.split()
+    return [tokens[n + 1].lower() for n, t in enumerate(tokens[:-1]) if t.upper() in ('AUX', 'AUXILIARY')]
+
+
+def _fixed_fields(lines, width, nfields):
+    '''
+    (n, nfields) array of the fixed-width fields in lines (as bytes strings), sliced for all lines at once
+    '''
+    linelength = width * nfields
+    text = np.array([line.rstrip('\r\n')[:linelength].ljust(linelength) for line in lines], dtype='S%d' % linelength)
+    return text.view('S%d' % width).reshape(len(lines), nfields)
+
+
+def _parse_block(lines, ncolumns, field_width=None):
+    '''
+    (n, ncolumns) float array of the values in a block of record lines (Layer Row Column first)
+    '''
+    n = len(lines)
+    if n == 0:
+        return np.zeros((0, ncolumns))
+    if field_width:
+        fields = _fixed_fields(lines, field_width, ncolumns)
+        fields[np.char.strip(fields) == b''] = b'0' # blank fields are zero
+        try:
+            return fields.astype(float)
+        except ValueError:
+            return io_utils.to_float(fields)
+    try:
+        values = np.fromstring(' '.join(lines).replace(',', ' '), sep=' ')
+    except ValueError: # newer numpy versions raise instead of stopping at text that isn't a number
+        values = []
+    if len(values) == n * ncolumns:
+        return values.reshape(n, ncolumns)
+    # lines with extra text (e.g. comments) or values that aren't numbers; PEST parameters (~ name ~) are one value
+    rows = [(re.sub(r'~[^~]*~', '~', line).replace(',', ' ').split() + [''] * ncolumns)[:ncolumns] for line in lines]
+    return io_utils.to_float(rows)
+
+
+def read_package(packagefile, package=None, field_width=None):
+    '''
+    read all stress periods of a list package
+
+    package: package type (key in package_variables); default is the file extension
+    field_width: width of each field for fixed-format input (e.g. 10); None for free format
+
+    returns dict with
+    package, field_width, aux (auxiliary variable names)
+    header: list of lines up to and including item 1 (comments, ptf marker, MXACT line)
+    periods: list of ITMP lines (one for each stress period, as read, with any comment or blank lines before them)
+    footer: list of any comment or blank lines after the last stress period
+    itmp: array of ITMP for each stress period
+    data: structured array with per (0-based stress period), k, i, j (1-based layer, row, column),
+        the package variables, and any auxiliary variables, for each record
+    lines: list of the record lines as read
+    '''
+    if package is None:
+        package = os.path.splitext(packagefile)[1][1:].upper()
+    package = package.upper()
+    if package not in package_variables:
+        raise ValueError('unknown list package {}; specify one of {}'.format(package, sorted(package_variables)))
+
+    with open(packagefile) as infile:
+        lines = infile.readlines()
+    header = []
+    n = 0
+    while n < len(lines) and _is_comment(lines[n]):
+        header.append(lines[n])
+        n += 1
+    if n == len(lines):
+        raise ValueError('{} has no item 1 (MXACT) line; only comment or blank lines were found'.format(packagefile))
+    if lines[n].strip().upper().startswith('PARAMETER'):
+        raise ValueError('parameters are not supported: {}'.format(lines[n].strip()))
+    header.append(lines[n]) # item 1
+    aux = _aux_names(lines[n])
+    n += 1
+
+    names = package_variables[package] + aux
+    ncolumns = 3 + len(names)
+    periods = []
+    itmp = []
+    blocks = []
+    records = []
+    comments = []
+    while n < len(lines):
+        if _is_comment(lines[n]):
+            comments.append(lines[n])
+            n += 1
+            continue
+        periods.append(''.join(comments) + lines[n])
+        comments = []
+        tokens = lines[n][:2 * field_width].split() if field_width else lines[n].split()
+        itmp.append(int(tokens[0]))
+        if len(tokens) > 1 and int(tokens[1]) > 0:
+            raise ValueError('parameters (NP > 0) are not supported: {}'.format(lines[n].strip()))
+        n += 1
+        block = lines[n:n + max(itmp[-1], 0)]
+        blocks.append(_parse_block(block, ncolumns, field_width))
+        records += block
+        n += len(block)
+
+    values = np.vstack(blocks) if len(blocks) > 0 else np.zeros((0, ncolumns))
+    dtype = [('per', int), ('k', int), ('i', int), ('j', int)] + [(name, float) for name in names]
+    data = np.zeros(len(values), dtype=dtype)
+    data['per'] = np.repeat(np.arange(len(blocks)), [len(b) for b in blocks])
+    for c, name in enumerate(['k', 'i', 'j'] + names):
+        data[name] = values[:, c]
+    return {'package': package, 'field_width': field_width, 'aux': aux, 'header': header,
+            'periods': periods, 'footer': comments, 'itmp': np.array(itmp, dtype=int), 'data': data, 'lines': records,
+            '_cells': np.column_stack([data['k'], data['i'], data['j']])}
+
+
+def period_records(pkg, per):
+    '''
+    records (structured array) in effect for a 0-based stress period, following ITMP < 0 back
+    to the last stress period with records listed
+    '''
+    while per > 0 and pkg['itmp'][per] < 0:
+        per -= 1
+    return pkg['data'][pkg['data']['per'] == per]
+
+
+def _fit_field(value, width):
+    # value with as many significant digits as fit in a fixed-width field
+    for digits in range(width - 1, 0, -1):
+        text = '%*.*G' % (width, digits, value)
+        if len(text) <= width:
+            break
+    return text
+
+
+def _format_records(data, names, field_width=None):
+    # record lines from the values in data (floats are written with full precision in free format,
+    # and with as many digits as fit in each field in fixed format)
+    columns = [c.tolist() for c in [data['k'], data['i'], data['j']] + [data[name] for name in names]]
+    if field_width:
+        fields = [['%*d' % (field_width, v) for v in c] for c in columns[:3]] + \
+                 [[_fit_field(v, field_width) for v in c] for c in columns[3:]]
+        return [''.join(r) + '\n' for r in zip(*fields)]
+    fmt = ' '.join(['%d'] * 3 + ['%r'] * len(names)) + '\n'
+    return [fmt % r for r in zip(*columns)]
+
+
+def _replace_cells(line, k, i, j, field_width=None):
+    # record line with a new Layer Row Column, and the rest of the line as read
+    if field_width:
+        return '%*d%*d%*d' % (field_width, k, field_width, i, field_width, j) + line[3 * field_width:]
+    fields = line.replace(',', ' ').split(None, 3)
+    return '%d %d %d %s' % (k, i, j, fields[3] if len(fields) > 3 else '\n')
+
+
+def write_package(packagefile, pkg, from_values=False):
+    '''
+    write a list package read by read_package, in its original format (free or fixed)
+
+    records are written as read, except those with a new Layer Row Column (or all records
+    from the values in pkg['data'] if from_values=True; PEST template parameters are then lost)
+    '''
+    data = pkg['data']
+    names = [name for name in data.dtype.names if name not in ('per', 'k', 'i', 'j')]
+    if from_values or pkg.get('lines') is None:
+        lines = _format_records(data, names, pkg.get('field_width'))
+    else:
+        lines = list(pkg['lines'])
+        cells = np.column_stack([data['k'], data['i'], data['j']])
+        for n in np.where((cells != pkg['_cells']).any(axis=1))[0]:
+            lines[n] = _replace_cells(lines[n], cells[n, 0], cells[n, 1], cells[n, 2], pkg.get('field_width'))
+
+    ofp = open(packagefile, 'w')
+    ofp.write(''.join(pkg['header']))
+    starts = np.searchsorted(data['per'], np.arange(len(pkg['periods']) + 1))
+    for p, itmp_line in enumerate(pkg['periods']):
+        ofp.write(itmp_line)
+        ofp.write(''.join(lines[starts[p]:starts[p + 1]]))
+    ofp.write(''.join(pkg.get('footer', [])))
+    ofp.close()
+
+
+def reassign_layers(k, i, j, elevation, layer_elevs):
+    '''
+    new layers for boundary cells with an elevation below the top of their layer, for all records at once:
+    each is moved to the highest layer with its top at or below the elevation
+    (elevations below the model bottom are placed in the bottom layer)
+
+    k, i, j: 1-based layer, row, column arrays
+    elevation: array of boundary elevations (records with nan are not changed)
+    layer_elevs: (nlay+1, nrow, ncol) array of model top and layer bottoms
+
+    returns array of new layers, and boolean array of the records that were changed
+    '''
+    nlay = layer_elevs.shape[0] - 1
+    # elevations of the layer tops and bottom for each record (records x nlay+1)
+    column = layer_elevs[:, i - 1, j - 1].T
+    below_top = elevation < column[np.arange(len(k)), k - 1]
+    # number of layer surfaces above the elevation; same as np.searchsorted on each (descending) column
+    newk = np.minimum((column > elevation[:, np.newaxis]).sum(axis=1) + 1, nlay)
+    changed = below_top & (newk != k)
+    return np.where(changed, newk, k), changed
+
+
+def read_first_period(packagefile, package='GHB', nvalues=1, field_width=None):
+    '''
+    cells and values for the first stress period of a list package
+
+    nvalues: number of package variables to return (e.g. 1 for the GHB stage)
+
+    returns (n, 3) int array of 1-based layer, row and column, and (n, nvalues) float array of values
+    '''
+    pkg = read_package(packagefile, package, field_width)
+    first = period_records(pkg, 0)
+    cells = np.column_stack([first['k'], first['i'], first['j']])
+    names = package_variables[pkg['package']][:nvalues]
+    values = np.column_stack([first[name] for name in names])
+    return cells, values.reshape(-1, nvalues)
@@ -17,9 +17,9 @@
 import numpy as np
 from collections import defaultdict
 import datetime as dt
-import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-from matplotlib.backends.backend_pdf import PdfPages
+import NWIS_utils
+import NWIS_plots
 
 # Input files
 infofile='Columbia_header.txt'
@@ -28,86 +28,54 @@ coordsfile= 'Columbia_NWIS_headsWTM.csv'
 
 # Outfiles
 pdffile='extended_records.pdf'
+renames_file='renamed_wells.csv' # wells that were renamed to avoid duplicate names
 
 # Settings
 mode='GFLOW' # GFLOW or MODFLOW; writes either a tp file, or .hob file for MF2k observation process
 discard_lev_status_cd=['P','R','S','T','Z'] # list of level_status_cds to discard (e.g. if well was being pumped)
+chunksize=100000 # number of water levels read at a time
+plot_categories=['best','good','fair','poor'] # only plot wells in these categories
+min_plot_measurements=2 # only plot wells with at least this many measurements
+max_plots=None # maximum number of wells to plot (None for no limit)
+plot_processes=4 # number of processes used for plotting (1 to plot without starting new processes)
+name_length=15 # maximum length of observation names (10 digits from site_no + '_' + 4-letter category)
+rules_file=None # optional csv of category,conditions rules for sorting wells (None to use NWIS_utils.classification_rules)
 screen_length=50 # assumed open interval length- NWIS only has well bottoms, so this will be added to bottom to get an open interval for the target. This is also important for avoiding wells being placed in thin (e.g. 1 ft.) "dummy" layers.
 
 
 print "getting well info, water levels, and coordinates..."
 
-# get header info
+# read site info, and read levels in chunks (levels with bad status codes are tossed while reading; see above)
+# per-well attributes are parsed into typed columns and joined to each chunk of levels
+# (site table is indexed, instead of searching it for every level)
+info=NWIS_utils.concat_chunks(NWIS_utils.read_rdb(infofile))
+sites=NWIS_utils.parse_sites(info)
 
-def getheader(filename,indicator,delimiter):
-    headervar=0
-    infile=open(filename,'r').readlines()
-    for line in infile:
-        cline=line.strip().split(delimiter)
-        if cline[0]=='agency_cd':
-            break
-        else:
-            headervar+=1
-    return(headervar)
+# keep the site_no, date, level elevation and status code of each level as arrays, one set for each chunk
+# (levels without a complete date are skipped); they are grouped by well after reading
 
-info_header=getheader(infofile,'agency_cd','\t')
-levels_header=getheader(levelsfile,'agency_cd','\t')
-        
-info=np.genfromtxt(infofile,delimiter='\t',skiprows=info_header,names=True,dtype=None)[1:]
-levelsdata=np.genfromtxt(levelsfile,delimiter='\t',skiprows=levels_header,names=True,dtype=None)[1:]
-
-wells=np.unique(levelsdata['site_no'])
-
-# build dictionaries of levels,dates and codes by USGS well no.
-
-levels=defaultdict(list)
-dates=defaultdict(list)
-codes=defaultdict(list)
-WellDepth_elev=defaultdict()
-pumping_count=defaultdict(list)
+pumping_count=defaultdict(int) # keep track of number of wells and levels influenced by pumping
+allwells=set()
+chunks=[]
 
 discarded=open('discarded_wells.txt','w')
-# Go through each level in levels file
-for line in levelsdata:
-    wellnum=line['site_no']
-    status=line['lev_status_cd']
-    
-    # toss out water levels with bad status code (see above)
-    discard=False
-    for code in discard_lev_status_cd:
-        if status==code:
-            discard=True
-            pumping_count[wellnum].append(1) # keep track of number of wells and levels influenced by pumping
-            break
-        
-    if discard:
-        continue # skip level
-        
-    info_ind=np.where(info['site_no']==wellnum)[0][0] 
-    elevation=float(info['alt_va'][info_ind].strip())
-    try:
-        date=dt.datetime.strptime(line['lev_dt'],'%Y-%m-%d')
-    except ValueError:
-        continue
-    level=line['lev_va']
-    try:
-        level=elevation-float(level)
-    except ValueError:
-        level=None
-    try:
-        welldepth_elev=elevation-float(info['well_depth_va'][info_ind].strip())   
-    except ValueError:
-        welldepth_elev=None
-    dates[wellnum].append(date)
-    levels[wellnum].append(level)
-    codes[wellnum].append(status)
-    WellDepth_elev[wellnum]=welldepth_elev
-
-pumping_discarded_levels=len([item for sublist in pumping_count.values() for item in sublist])
+for chunk in NWIS_utils.read_rdb(levelsfile,chunksize=chunksize,discard={'lev_status_cd':discard_lev_status_cd},discarded=pumping_count):
+    allwells.update(np.unique(chunk['site_no']).tolist())
+    dated=~np.isnat(chunk['lev_dt'])
+    chunk_sites=NWIS_utils.join_sites(chunk['site_no'][dated],sites)
+    chunks.append({'site_no':chunk['site_no'][dated],
+                   'date':chunk['lev_dt'][dated].astype('datetime64[s]'),
+                   'WL':chunk_sites['alt_va']-chunk['lev_va'][dated],
+                   'code':chunk['lev_status_cd'][dated]})
+
+wells=np.unique(list(allwells.union(pumping_count.keys())))
+wells_inds=dict(zip(wells,NWIS_utils.site_index(wells,sites)))
+
+pumping_discarded_levels=sum(pumping_count.values())
 print "Discarded %s pumping-influenced levels from %s wells..." %(pumping_discarded_levels,len(pumping_count.keys()))
 discarded.write('well,n_discarded\n')
 for key in pumping_count.iterkeys():
-    discarded.write('%s,%s\n' %(key,len(pumping_count[key])))
+    discarded.write('%s,%s\n' %(key,pumping_count[key]))
 
 # get coordinates from coordsfile
 coordsdata=np.genfromtxt(coordsfile,delimiter=',',names=True,dtype=None)
@@ -124,237 +92,94 @@ names=defaultdict(list)
 rejects=defaultdict(list)
 wells2plot=[]
 
+# toss wells with no dates; group the levels, dates and codes for the rest by well (a stable sort keeps
+# the levels of each well in file order); measurements for well i are allWLs[starts[i]:starts[i+1]], etc.
+measurements=NWIS_utils.concat_chunks(chunks)
+measured,well_idx=np.unique(measurements['site_no'],return_inverse=True)
+order=np.argsort(well_idx,kind='mergesort')
+well_idx=well_idx[order]
+alldates=measurements['date'][order]
+allWLs=measurements['WL'][order]
+allcodes=measurements['code'][order]
+starts=np.searchsorted(well_idx,np.arange(len(measured)+1))
+nmeas=np.diff(starts)
+measured=measured.tolist()
+del measurements,chunks
+
+# compute summary statistics for all wells (number of measurements and std post-1970, or for all
+# measurements if there are none post-1970; artesian flag), and join info from header file
+stats=NWIS_utils.well_statistics(well_idx,alldates,allWLs,allcodes,len(measured))
+measured_sites=NWIS_utils.join_sites(measured,sites)
+stats['reliability']=measured_sites['reliability_cd']
+stats['alt_acc']=measured_sites['alt_acy_va']
+stats['numWQ']=measured_sites['qw_count_nu']
+welldepth_elev=measured_sites['alt_va']-measured_sites['well_depth_va']
+WellDepth_elev=dict((well,None if np.isnan(welldepth_elev[i]) else welldepth_elev[i]) for i,well in enumerate(measured))
+
+# assign categories from rule table (see NWIS_utils.classification_rules)
+if rules_file is not None:
+    rules=NWIS_utils.read_rules(rules_file)
+else:
+    rules=NWIS_utils.classification_rules
+categories=NWIS_utils.classify(stats,rules)
+num_artesian=np.sum(stats['artesian'])
+
 # writeout information on "poor" wells that didn't meet any of the quality criteria
 discarded.write('\n\nwell,num_measurements,reliability_code,alt_accuracy\n')
-num_artesian=0
-for well in wells:    
-    print well
-    
-    # reset variables
-    name=None
-    dateslist=[]
-    maxmin=None
-    n=0
-    artesian=False
-    
-    # get list of measurement dates
-    # toss wells with no dates
-    dateslist=dates[well]
-    if len(dateslist)==0:
-        continue    
+levels=dict() # level for each well
+for i,well in enumerate(measured):
     
-    # get info from header file
-    info_ind=np.where(info['site_no']==well)[0][0]
-    alt_acc=float(info['alt_acy_va'][info_ind].strip())
-    numWQ=float(info['qw_count_nu'][info_ind].strip())
-    Drely=info['reliability_cd'][info_ind]
-    elevation=float(info['alt_va'][info_ind].strip())
-    
-    # before sorting, identify wells with more than one measurement
-    # extract single value from list for wells with one measurement
+    # identify wells with more than one measurement
+    # extract single value for wells with one measurement
     # for artesian wells, set GW elevation to wellhead elevation if no value
-    
-    if levels[well][0]==None:
-        if 'F' in codes[well]:
-            artesian=True
-            levels[well]=elevation
-            num_artesian+=1
-        elif 'E' in codes[well]:
-            artesian=True
-            levels[well]=elevation
-            num_artesian+=1        
-    elif len(levels[well])>1:
-        wells2plot.append(well)
-        maxmin=np.max(levels[well])-np.min(levels[well])
-    elif len(levels[well])==1:
-        try:
-            levels[well]=levels[well][0]
-        except TypeError: # if no level, value obtained from file might be ''
-            if 'F' in codes[well]:
-                artesian=True
-                levels[well]=elevation
-                num_artesian+=1
-            elif 'E' in codes[well]:
-                artesian=True
-                levels[well]=elevation
-                num_artesian+=1
-                
-    # keep only wells that have been checked by a reporting agency
-    if Drely=='C':
-        
-        # get water levels and std
-        WLs=levels[well]
-        try:
-            std=np.std(WLs)
-        except TypeError: # means there is only one measurement
-            std=None
-            
-        # get water levels after 1970
-        after1970_inds=list(np.where(np.array(dateslist)>dt.datetime(1970,1,1,0,0))[0])
-        n=len(after1970_inds)
-        
-        # function to assign weight category based on standard dev
-        def assignby_std(std,name,tier):
-            # tier =1,2 (best,good); sets a ceiling on the highest name to assign
-            if tier==1 and std<=5:
-                name=name+'_best'
-            elif tier>=1 and std<=10:
-                name=name+'_good'
-            else: # std is >10
-                name=name+'_fair'
-            return name
-        
-        # if there are measurements post1970
-        if n>0:
-            
-            # cull levels to post1970 (just for weight category assignment)
-            try:
-                WLs=[i for j, i in enumerate(levels[well]) if j in after1970_inds]
-                std=np.std(WLs)
-            except TypeError: # means there is only one measurement
-                std=None  
-            
-            # more than two measurements after 1970
-            if n>2 and alt_acc<=10:
-                
-                if alt_acc<=5 and n>2:
-                    name=assignby_std(std,well[5:],1)
-                elif alt_acc<=10 and n>30:
-                    name=assignby_std(std,well[5:],1)
-                elif alt_acc<=10 and n>2:
-                    name=assignby_std(std,well[5:],2)
-                else:
-                    name=well[5:]+'_fair'
-            
-            # Just two
-            elif n==2 and alt_acc<=5:
-                name=assignby_std(std,well[5:],2)
-                
-            # Only one measurement post 1970
-            elif n==1 and alt_acc<5:
-                name=well[5:]+'_good'
-            elif n==1 and numWQ>0 and alt_acc<=5:
-                name=well[5:]+'_good'
-            elif n==1 and artesian and alt_acc<=5:
-                name=well[5:]+'_good'
-            elif n==1 and alt_acc<=10: 
-                name=well[5:]+'_fair'
-            else:
-                name=well[5:]+'_poor'
-                rejects[well].append([n,Drely,alt_acc,name])
-                discarded.write('%s,%s,%s,%s,%s\n' %(well,n,Drely,alt_acc,name))            
-        
-        # No measurements after 1970
-        else:
-            n=len(dateslist)
-            
-            # if >2 measurements and good alt accuracy
-            if n>2 and alt_acc<=5:
-                name=assignby_std(std,well[5:],2)
-            elif alt_acc<=10:
-                name=well[5:]+'_fair'
-                
-            # only one pre1970 measurement or poor alt accuracy
-            else:
-                name=well[5:]+'_poor'
-                rejects[well].append([n,Drely,alt_acc,name])
-                discarded.write('%s,%s,%s,%s,%s\n' %(well,n,Drely,alt_acc,name))
-                
-    # measurement has not been checked by reporting agency
-    # keep only post 1970, and then only wells with 2+ measurements, std<=10, and alt accuracy <=10
-    
-    elif Drely=='U':
-        
-        after1970_inds=list(np.where(np.array(dateslist)>dt.datetime(1970,1,1,0,0))[0])
-        n=len(after1970_inds)        
-        try:
-            WLs=[i for j, i in enumerate(levels[well]) if j in after1970_inds]
-            std=np.std(WLs)
-        except TypeError: # means there is only one measurement
-            std=None
-            
-        if n>2 and alt_acc<=5:
-            if std<=5:
-                name=well[5:]+'_good'
-        elif n>30 and alt_acc<=10:
-            if std<=5:
-                name=well[5:]+'_good'
-        elif n>2 and alt_acc<=10:
-            if std<=10:
-                name=well[5:]+'_fair'
-        else:
-            name=well[5:]+'_poor'
-            rejects[well].append([n,Drely,alt_acc,name])
-            discarded.write('%s,%s,%s,%s,%s\n' %(well,n,Drely,alt_acc,name))            
-            
-    # discarded because not reliable
+    levels[well]=allWLs[starts[i]:starts[i+1]]
+    if np.isnan(allWLs[starts[i]]):
+        if stats['artesian'][i]:
+            levels[well]=measured_sites['alt_va'][i]
+    elif nmeas[i]>1:
+        wells2plot.append(i)
     else:
-        name=well[5:]+'_poor'
+        levels[well]=allWLs[starts[i]]
+    
+    name=well[5:]+'_'+categories[i]
+    if categories[i]=='poor':
+        n,Drely,alt_acc=stats['n'][i],stats['reliability'][i],stats['alt_acc'][i]
         rejects[well].append([n,Drely,alt_acc,name])
         discarded.write('%s,%s,%s,%s,%s\n' %(well,n,Drely,alt_acc,name))
     names[well]=name
 discarded.close()
 
-# all names are assigned; build list and check for duplicates
-# if duplicates, use different 10-digit string of site_no
-# continue, changing 10 digit string, until no duplicates
-# reduce digits taken from site number if necessary
-nameslist=[]
-
-dupscount=0
+# all names are assigned; check for duplicates in one pass
+# if duplicates, use different 10-digit string of site_no (see NWIS_utils.unique_names)
 print "modifying any duplicate names by choosing new 10-digit strings from site numbers..."
 print "(duplicate names occur because only a 10-digit subset of the 15-digit ID is used for names;\nsome programs like GFLOW or PEST have observation name length limits)"
 
-for name in names.itervalues():
-    nameslist.append(name)
-num_dups=len(nameslist)-len(np.unique(np.array(nameslist)))
-i=0
-while num_dups>0:
-    dupscount=0
-    i+=1
-    wells2delete=[]
-    for well in names.iterkeys():
-        if len(names[well])==0:
-            wells2delete.append(well)
-            continue
-        count=nameslist.count(names[well])
-        if count>1:
-            dupscount+=1
-            oldname=names[well]
-            if i<=4:
-                names[well]=well[4-i:(-1-i)]+oldname[-5:]
-                print names[well]
-            else:
-                names[well]=well[i:]+oldname[-5:]
-    print "fixed %s duplicate names!" %(dupscount)
-    for well in wells2delete:
-        print 'deleting well: %s\n' %(well)
-        del names[well]
-    nameslist=[]
-    for name in names.itervalues():
-        nameslist.append(name)    
-    num_dups=len(nameslist)-len(np.unique(np.array(nameslist)))
-    if num_dups>0:
-        print "still duplicates; trying new 10-digit strings from site numbers.."
-    else:
-        break
-print "done fixing duplicates!"
+for well in [well for well in names.iterkeys() if len(names[well])==0]:
+    print 'deleting well: %s\n' %(well)
+    del names[well]
+unique,renamed=NWIS_utils.unique_names(names,maxlen=name_length)
+names.update(unique)
+ofp=open(renames_file,'w')
+ofp.write('site_no,old_name,new_name\n')
+for well in sorted(renamed.iterkeys()):
+    ofp.write('%s,%s,%s\n' %(well,renamed[well][0],renamed[well][1]))
+ofp.close()
+print "renamed %s wells with duplicate or too long names (see %s)" %(len(renamed),renames_file)
 
 # For wells with multiple measurements, calculate average values for post and pre-1970
 # Plot out measurements and average values for comparison
 # replace multiple levels with new average level
-pdf=PdfPages(pdffile)
-
-print 'calculating average values; plotting levels for wells with multiple levels:'
-for well in wells2plot:
+print 'calculating average values for wells with multiple levels...'
+records=[] # information for plots
+for i in wells2plot:
     
-    print well
-    info_ind=np.where(info['site_no']==well)[0][0]
-    alt_acc=float(info['alt_acy_va'][info_ind].strip())
-    numWQ=float(info['qw_count_nu'][info_ind].strip())
-    codez=[c for c in codes[well] if c<>'']
-    dates2plot=list(mdates.date2num(dates[well]))
-    WLs=levels[well]
+    well=measured[i]
+    info_ind=wells_inds[well]
+    alt_acc=sites['alt_acy_va'][info_ind]
+    numWQ=sites['qw_count_nu'][info_ind]
+    codez=[c for c in allcodes[starts[i]:starts[i+1]].tolist() if c<>'']
+    dates2plot=list(mdates.date2num(alldates[starts[i]:starts[i+1]].astype(object)))
+    WLs=allWLs[starts[i]:starts[i+1]]
     use_post1970=True
     
     if len(dates2plot)<>len(WLs):
@@ -379,45 +204,24 @@ for well in wells2plot:
     # replace multiple values in levels file with average
     if len(post1970)==0:
         use_post1970=False
-        plot_title='WLs in well ' + names[well] + '; using pre-1970 average'
+        plot_title='WLs in well %s; using pre-1970 average' %(names[well])
         levels[well]=np.mean(pre1970WLs)
     if use_post1970:
-        plot_title='WLs in well ' + names[well] + '; using post-1970 average'
+        plot_title='WLs in well %s; using post-1970 average' %(names[well])
         levels[well]=np.mean(post1970WLs)
-        
-    fig, ax1 = plt.subplots(1,1,sharex=True,sharey=False)
-    ax1.grid(True)
-    p1=ax1.plot_date(dates2plot,WLs,'bo',label='WLs')
-    plt.xticks(rotation=45,fontsize=10)
-    plt.yticks(fontsize=10)
-    # get axis limits
-    # set plotting range for average values
-    x1,x2,y1,y2=ax1.axis()
-    if x1>cutoff:
-        start=x1
-    else:
-        start=cutoff
-    if x2>cutoff:
-        end=cutoff
-    else:
-        end=x2
     
-    # plot average values
-    if len(post1970)>0:
-        #ax1.axhline(y=avg_post1970, xmin=start, color='r',label='post-1970 avg')
-        p2=ax1.plot_date(post1970,avg_post1970,'r',label='post-1970 avg')
-        ax1.text(0.95,0.05,'stdev: %s\nalt accuracy: %s\nnum WQ: %s\nWell codes: %s' %(round(std_post1970,2),alt_acc,numWQ,codez),verticalalignment='bottom',horizontalalignment='right',transform=ax1.transAxes)    
-    if len(pre1970)>0:
-        #ax1.axhline(y=avg_pre1970, xmax=end, color='g',label='pre-1970 avg')
-        p3=ax1.plot_date(pre1970,avg_pre1970,'g',label='pre-1970 avg')
-        ax1.text(0.05,0.05,'stdev: %s\nalt accuracy: %s\nnum WQ: %s\nWell codes: %s' %(round(std_pre1970,2),alt_acc,numWQ,codez),verticalalignment='bottom',horizontalalignment='left',transform=ax1.transAxes)
-    handles, labels = ax1.get_legend_handles_labels()
-    ax1.legend(handles,labels)
-    ax1.set_title(plot_title)
-    pdf.savefig()
-pdf.close()
-plt.close('all')
-print "Done plotting, see %s for results" %(pdffile)
+    # only plot selected wells
+    if len(WLs)<min_plot_measurements or not names[well] or not any([c in names[well] for c in plot_categories]):
+        continue
+    if max_plots is not None and len(records)>=max_plots:
+        continue
+    records.append({'dates':dates2plot,'WLs':WLs,'title':plot_title,'alt_acc':alt_acc,'numWQ':numWQ,'codes':codez,
+                    'post1970':post1970,'avg_post1970':avg_post1970,'std_post1970':std_post1970,
+                    'pre1970':pre1970,'avg_pre1970':avg_pre1970,'std_pre1970':std_pre1970})
+
+print 'plotting levels for %s wells...' %(len(records))
+pdffiles=NWIS_plots.render_pdf(records,pdffile,processes=plot_processes)
+print "Done plotting, see %s for results" %(', '.join(pdffiles))
 
 print "writing testpoint files..."
 
@@ -0,0 +1,213 @@
+'''
+Utilities for building ZoneBudget zone arrays from polygon .ij files, and summarizing
+zone budgets from MFbinary_utils.zone_budget (used by Get_MB.py)
+
+Polygons that share cells can't be zones of one zone array, so build_zones returns a list of
+zone arrays (one for each group of polygons that don't overlap), and zone_budgets merges the
+budgets for all of them by zone number.
+
+usage:
+import zonbud_utils
+zonelist = zonbud_utils.build_zones(['a.ij', 'b.ij'], nlay, nrow, ncol)
+budgets = zonbud_utils.zone_budgets('model.cbb', zonelist)
+
+.ij files contain the cell indices of a polygon in the form:
+Row, Column (header)
+Row, Column (values; n lines for n cells)
+
+Zone budget results can be cached between runs in a json file, keyed by the absolute path,
+size and modification time of each budget file, and a hash of the zone arrays.
+'''
+import os
+import json
+import hashlib
+import numpy as np
+import GWV_utils
+import io_utils
+import MFarray_utils
+import MFbinary_utils
+
+
+def read_ij(ijfile):
+    '''
+    returns arrays of (1-based) rows and columns from a polygon .ij file
+    '''
+    rc = np.loadtxt(ijfile, delimiter=',', skiprows=1, dtype=int, ndmin=2)
+    return rc[:, 0], rc[:, 1]
+
+
+def build_zones(ijfiles, nlay, nrow, ncol):
+    '''
+    integer zone arrays (nlay, nrow, ncol) with each polygon in ijfiles as its own zone
+    (zone n is ijfiles[n-1]; cells outside of the polygons are zone 0). Polygons apply to all layers.
+
+    Polygons that share cells are put in separate zone arrays, so that each polygon gets all of its cells;
+    returns a list of zone arrays (one for each group of polygons that don't overlap; usually just one)
+    '''
+    groups = []
+    for z, ijfile in enumerate(ijfiles):
+        rows, cols = read_ij(ijfile)
+        for zones2d in groups:
+            if not zones2d[rows - 1, cols - 1].any():
+                break
+        else:
+            zones2d = np.zeros((nrow, ncol), dtype=int)
+            groups.append(zones2d)
+        zones2d[rows - 1, cols - 1] = z + 1
+    return [np.tile(zones2d, (nlay, 1, 1)) for zones2d in groups]
+
+
+def zone_budgets(cbbfile, zonelist):
+    '''
+    zone budgets (as MFbinary_utils.zone_budget) for the zone arrays from build_zones (one pass through the
+    memory-mapped budget file for each zone array); results for each group of polygons are merged into one set of arrays indexed by zone number
+    (with flows between polygons in different groups counted as flows to and from zone 0)
+    '''
+    cbb = MFbinary_utils.CellBudgetFile(cbbfile)
+    if len(zonelist) == 1:
+        return MFbinary_utils.zone_budget(cbb, zonelist[0])
+    nzones = max(zones.max() for zones in zonelist) + 1
+    budgets = {}
+    for zones in zonelist:
+        group = np.union1d([0], np.unique(zones)) # zone 0 and the polygons in the group
+        polygons = group[1:]
+        for key, b in MFbinary_utils.zone_budget(cbb, zones).items():
+            merged = budgets.setdefault(key, {'in': {}, 'out': {}, 'interzone': np.zeros((nzones, nzones))})
+            for direction in ['in', 'out']:
+                for term, q in b[direction].items():
+                    merged[direction].setdefault(term, np.zeros(nzones))[polygons] = q[polygons]
+            merged['interzone'][np.ix_(group, group)] = b['interzone'][np.ix_(group, group)]
+    return budgets
+
+
+def write_zon(zonfile, zones):
+    '''
+    write a ZoneBudget zone file for a (nlay, nrow, ncol) integer zone array, a layer at a time
+    layers with a single zone are written as CONSTANT records
+    '''
+    nlay, nrow, ncol = zones.shape
+    width = len(str(max(zones.max(), 0))) + 1
+    fmt = '%{}d'.format(width - 1)
+    ofp = open(zonfile, 'w')
+    ofp.write('%s %s %s\n' % (nlay, nrow, ncol))
+    MFarray_utils.write_layers(ofp, zones, fmt=fmt, delimiter=' ', newline=' \n',
+                               control='INTERNAL (' + str(ncol) + 'I' + str(width) + ')', constant=True)
+    ofp.close()
+
+
+# budget terms listed in Get_MB.py summaries
+summary_terms = ['CONSTANT HEAD', 'DRAINS', 'RIVER LEAKAGE']
+
+
+def write_summary(ofp, budgets, zonenames, label):
+    '''
+    write zone budget summaries (from zone_budgets) for each polygon and time step
+
+    ofp: open output file
+    budgets: results from zone_budgets (as MFbinary_utils.zone_budget)
+    zonenames: dict of zone number: polygon name (zone 0, outside of the polygons, is not reported)
+    label: name of the run/scenario, for the summary headings
+
+    Nearfield_mass_balance polygons only get the percent discrepancy; for other polygons,
+    the IN and OUT values for summary_terms are listed, with net fluxes to river cells
+    and (for Quarries polygons) to constant head and drain cells
+    '''
+    for kstp, kper in sorted(budgets.keys(), key=lambda k: (k[1], k[0])):
+        b = budgets[(kstp, kper)]
+        total_in, total_out, discrepancy = MFbinary_utils.budget_totals(b)
+        for z in sorted(zonenames.keys()):
+            zonename = zonenames[z]
+            heading = '%s %s (time step %s, stress period %s)' % (label, zonename, kstp, kper)
+            if z >= len(total_in):
+                continue
+            if 'Nearfield_mass_balance' in zonename:
+                ofp.write('Nearfield Mass Bal. for %s Percent Discrepancy = %s\n' % (heading, discrepancy[z]))
+                continue
+            q = {}
+            ofp.write('Zone budget for %s\n' % heading)
+            for direction in ['in', 'out']:
+                ofp.write(direction.upper() + ':\n')
+                for term in summary_terms:
+                    q[term, direction] = b[direction][term][z] if term in b[direction] else 0.
+                    if term in b[direction]:
+                        ofp.write('%18s = %s\n' % (term, q[term, direction]))
+            ofp.write('Percent Discrepancy = %s\n' % discrepancy[z])
+            ofp.write('\n')
+            ofp.write('Net fluxes for %s\n' % heading)
+            if 'Quarries' in zonename:
+                Qnet = q['CONSTANT HEAD', 'out'] - q['CONSTANT HEAD', 'in'] + q['DRAINS', 'out']
+                ofp.write('Quarries = %s\n' % Qnet)
+            RIVnet = q['RIVER LEAKAGE', 'out'] - q['RIVER LEAKAGE', 'in']
+            ofp.write('Net flux to River Cells (Out-In) = %s\n' % RIVnet)
+            ofp.write('\n')
+
+
+def zones_hash(zonelist):
+    '''
+    md5 hexdigest of the zone arrays from build_zones (number of groups of polygons, and the shape and values
+    of each zone array), for keying cached zone budgets
+    '''
+    md5 = hashlib.md5(str(len(zonelist)).encode('ascii'))
+    for zones in zonelist:
+        zones = np.ascontiguousarray(zones, dtype='<i4')
+        md5.update(str(zones.shape).encode('ascii'))
+        md5.update(zones.tobytes())
+    return md5.hexdigest()
+
+
+def budgets_to_json(budgets):
+    '''
+    zone_budget results as a json-serializable dict (keys are 'kstp,kper')
+    '''
+    out = {}
+    for (kstp, kper), b in budgets.items():
+        out['%s,%s' % (kstp, kper)] = {'in': dict((t, list(map(float, q))) for t, q in b['in'].items()),
+                                       'out': dict((t, list(map(float, q))) for t, q in b['out'].items()),
+                                       'interzone': np.asarray(b['interzone']).tolist()}
+    return out
+
+
+def budgets_from_json(d):
+    '''
+    inverse of budgets_to_json
+    '''
+    budgets = {}
+    for key, b in d.items():
+        kstp, kper = [int(v) for v in key.split(',')]
+        budgets[(kstp, kper)] = {'in': dict((str(t), np.array(q)) for t, q in b['in'].items()),
+                                 'out': dict((str(t), np.array(q)) for t, q in b['out'].items()),
+                                 'interzone': np.array(b['interzone'])}
+    return budgets
+
+
+def load_cache(cachefile):
+    '''
+    results cache from a previous run (dict of absolute filename: entry); empty if missing or unreadable
+    '''
+    try:
+        with open(cachefile) as infile:
+            return json.load(infile)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_cache(cache, cachefile):
+    '''
+    write the results cache (to a temporary file first, so that an interrupted run can't leave a bad cache)
+    '''
+    with open(cachefile + '.tmp', 'w') as ofp:
+        json.dump(cache, ofp)
+    io_utils.replace_file(cachefile + '.tmp', cachefile)
+
+
+def cached_entry(cache, filename, zhash=None):
+    '''
+    cache entry for filename if its size and modification time (and the zone array hash, if given)
+    match those when it was cached; otherwise None
+    '''
+    entry = cache.get(os.path.abspath(filename))
+    if entry is None or entry.get('source') != GWV_utils.file_signature(filename):
+        return None
+    if zhash is not None and entry.get('zones') != zhash:
+        return None
+    return entry